@@ -1,19 +1,32 @@
-from flask import Flask, jsonify, request
+import hmac
+import json
+import math
+import os
+import threading
+import time
+
+from flask import Flask, g, jsonify, request, send_from_directory
 from flask_cors import cross_origin
 import requests
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from ada_checks import check_h1, check_headers, check_lang, check_title, check_img_alt, check_link_text
 from contrast_check import check_contrast_ratio
+from http_body import HTMLBodyError, compress_body, decode_html, get_max_html_bytes, read_body
+from monitor import delete_monitor, get_changes, list_monitors, register_monitor
+from profiler import get_input_stats, get_profiler_settings, get_sampler, is_profile_name, list_profiles, save_profile
+from result_cache import get_cached_result, store_result
+from sandbox import ResourceLimitError, WorkerError, get_sandbox_pool
 
 # Create an instance of the Flask application
 # The __name__ variable helps Flask find the root path of the application
 app = Flask(__name__)
 
-def check_html_accessibility(input_string):
-    # Ensure the input_string is actually a string.
-    if not isinstance(input_string, str):
-        return jsonify({"message": "Invalid input: 'html' must be a string"}), 400
+# Room for the boundaries and part headers of a multipart upload on top of the html size limit
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
 
+def run_checks(input_string, collapse_repeats=False):
+    """Runs every accessibility check on an html string and returns the list of violations."""
     response = []
 
     # Check the language attribute.
@@ -27,7 +40,8 @@ def check_html_accessibility(input_string):
         response.append(title_err)
 
     # Check the color contrast.
-    contrast_err = check_contrast_ratio(input_string)
+    # The styles of repeated components are only computed once, and their violations are optionally reported once with a count.
+    contrast_err = check_contrast_ratio(input_string, collapse_repeats)
     if contrast_err:
         response.extend(contrast_err)
 
@@ -51,9 +65,150 @@ def check_html_accessibility(input_string):
     if header_err:
         response.extend(header_err)
 
+    return response
+
+def check_html_accessibility(input_string, collapse_repeats=False):
+    # Ensure the input_string is actually a string.
+    if not isinstance(input_string, str):
+        return jsonify({"message": "Invalid input: 'html' must be a string"}), 400
+
+    # Keep what was checked, in case the request is slow enough to be profiled.
+    if 'profile_settings' in g:
+        g.profile_input = input_string
+
+    # Reuse the results if any worker has already checked this html.
+    cache_variant = "collapsed" if collapse_repeats else ""
+    cached_response = get_cached_result(input_string, cache_variant)
+    if cached_response is not None:
+        return jsonify(cached_response), 200
+
+    # Run the checks in a sandboxed worker process if the sandbox is enabled, so a pathological document
+    # can't stall or crash this process.
+    pool = get_sandbox_pool(run_checks)
+    if pool:
+        try:
+            response = pool.run(input_string, collapse_repeats)
+        except ResourceLimitError as e:
+            return jsonify({
+                "message": "Resource limit exceeded: the html could not be checked within the " + e.limit + " limit.",
+                "error": "RESOURCE_LIMIT_EXCEEDED",
+                "limit": e.limit
+            }), 422
+        except WorkerError:
+            return jsonify({
+                "message": "The html could not be checked because the worker process failed. Please try again.",
+                "error": "WORKER_FAILED"
+            }), 503
+    else:
+        response = run_checks(input_string, collapse_repeats)
+
+    # Share the results with the other workers.
+    store_result(input_string, response, cache_variant)
+
     # Return the result as a JSON object.
     return jsonify(response), 200
 
+def read_html_request():
+    """
+    Reads the html to check from the request body, which can be:
+    * a JSON object like {"html": "your string here"}
+    * raw html with a text/html (or any other non-JSON) Content-Type
+    * a multipart/form-data upload with the html file in the 'html' field (or the only file)
+    JSON and raw bodies may be compressed with a gzip, deflate or br Content-Encoding, and uploaded files may be
+    gzip-compressed (.gz). Bodies are decompressed in chunks up to a size limit, which also applies to the whole
+    multipart body.
+
+    Returns:
+        The html string, or the value of the 'html' key for JSON bodies.
+    """
+    if request.mimetype == 'multipart/form-data':
+        # Werkzeug parses the whole multipart body, so limit it before it is read
+        max_bytes = get_max_html_bytes()
+        request.max_content_length = max_bytes + MULTIPART_OVERHEAD_BYTES
+        try:
+            files = request.files
+        except RequestEntityTooLarge:
+            raise HTMLBodyError(f"The html is too large. The limit is {max_bytes} bytes.", 413)
+        upload = files.get('html') or next(iter(files.values()), None)
+        if not upload:
+            raise HTMLBodyError("Invalid request: an html file upload is required")
+        compressed = upload.mimetype in ('application/gzip', 'application/x-gzip') or (upload.filename or '').endswith('.gz')
+        data = read_body(upload.stream, 'gzip' if compressed else None)
+        return decode_html(data, upload.mimetype_params.get('charset'))
+
+    if request.is_json:
+        try:
+            request_data = json.loads(read_body(request.stream, request.content_encoding))
+        except ValueError:
+            request_data = None
+
+        # Validate that the request_data is not empty and contains the 'html' key.
+        if not isinstance(request_data, dict) or 'html' not in request_data:
+            raise HTMLBodyError("Invalid request: JSON object with 'html' key required")
+        return request_data['html']
+
+    data = read_body(request.stream, request.content_encoding)
+    return decode_html(data, request.mimetype_params.get('charset'))
+
+def get_collapse_repeats():
+    """Returns True if the request asks for repeated violations to be collapsed with ?collapse=true."""
+    return request.args.get('collapse', '').lower() in ('1', 'true', 'yes')
+
+@app.before_request
+def start_profiling():
+    """
+    Samples the stack of every request while the profiler is enabled (see profiler.py).
+    Only the samples of requests slower than the threshold are saved.
+    """
+    settings = get_profiler_settings()
+    if not settings or request.path.startswith('/api/v1/admin/'):
+        return
+    g.profile_settings = settings
+    g.profile_start = time.perf_counter()
+    get_sampler(settings['interval_ms']).start(threading.get_ident())
+
+@app.teardown_request
+def stop_profiling(exception):
+    """Saves the profile of the request if it was slower than the threshold."""
+    settings = g.pop('profile_settings', None)
+    if not settings:
+        return
+    samples = get_sampler(settings['interval_ms']).stop(threading.get_ident())
+    duration_ms = (time.perf_counter() - g.profile_start) * 1000
+    if duration_ms < settings['threshold_ms']:
+        return
+
+    try:
+        save_profile(settings['profile_dir'], samples, {
+            "method": request.method,
+            "path": request.path,
+            "duration_ms": round(duration_ms, 1),
+            "finished": time.time(),
+            "input": get_input_stats(g.profile_input) if 'profile_input' in g else None,
+        }, settings['max_profiles'])
+    except OSError as e:
+        print(f"Warning: Could not save the profile. Error: {e}")
+
+def is_admin_request():
+    """Returns True if the request has the admin token from ADA_ADMIN_TOKEN as a Bearer token."""
+    token = os.environ.get('ADA_ADMIN_TOKEN')
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+@app.after_request
+def compress_response(response):
+    """Compresses JSON responses when the client accepts gzip or br."""
+    if response.direct_passthrough or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers:
+        return response
+
+    encoding, body = compress_body(response.get_data(), request.accept_encodings)
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 # Define an API endpoint for the root URL ('/')
 # This endpoint will respond to GET requests.
 @app.route('/')
@@ -69,26 +224,26 @@ def home():
 @cross_origin()
 def check_string():
     """
-    Expects a JSON payload like: {"html": "your string here"}.
+    Expects a JSON payload like: {"html": "your string here"}, a raw text/html body, or a multipart file upload.
+    Bodies can be gzip or br compressed (see read_html_request). Add ?collapse=true to report repeated
+    contrast violations once with a count.
     Returns a JSON response: [{"problem": "Low Contrast Ratio", "element": "<h1>" , "details": "The contrast ratio is 1.98. The
     minimum required for large text is 3.0.", "rule": ""COLOR_CONTRAST"}, {...}].
     """
-    request_data = request.get_json()
-
-    # Validate that the request_data is not empty and contains the 'html' key.
-    if not request_data or 'html' not in request_data:
-        return jsonify({"message": "Invalid request: JSON object with 'html' key required"}), 400
-
-    input_string = request_data['html']
+    try:
+        input_string = read_html_request()
+    except HTMLBodyError as e:
+        return jsonify({"message": e.message}), e.status_code
     
-    return check_html_accessibility(input_string)
+    return check_html_accessibility(input_string, get_collapse_repeats())
     
 # This endpoint will respond to POST requests to '/api/v1/url-check'.
 @app.route('/api/v1/url-check', methods=['POST'])
 @cross_origin()
 def check_url():
     """
-    Expects a JSON payload like: {"url": "your url here"}.
+    Expects a JSON payload like: {"url": "your url here"}. Add ?collapse=true to report repeated contrast
+    violations once with a count.
     Returns a JSON response: [{"problem": "Low Contrast Ratio", "element": "<h1>" , "details": "The contrast ratio is 1.98. The
     minimum required for large text is 3.0.", "rule": ""COLOR_CONTRAST"}, {...}].
     """
@@ -114,7 +269,84 @@ def check_url():
     if not "<html" in input_string:
         return jsonify({"message": "Could not retreive HTML from the provided URL. Please try a different URL."})
 
-    return check_html_accessibility(input_string)
+    return check_html_accessibility(input_string, get_collapse_repeats())
+
+# This endpoint registers a URL to be checked on a schedule by the monitor scheduler (see monitor.py).
+@app.route('/api/v1/monitors', methods=['POST'])
+@cross_origin()
+def add_monitor():
+    """
+    Expects a JSON payload like: {"url": "your url here", "interval_seconds": 3600}. The interval is clamped
+    between 60 seconds and a year. Needs the admin token, since the server fetches the URL on a schedule.
+    Returns the registered monitor: {"id": 1, "url": "...", "interval_seconds": 3600, "next_run": ..., ...}.
+    """
+    if not is_admin_request():
+        return jsonify({"message": "Unauthorized: an admin token is required"}), 401
+
+    request_data = request.get_json(silent=True)
+
+    # Validate that the request_data contains the 'url' key and a numeric interval.
+    if not request_data or not isinstance(request_data.get('url'), str):
+        return jsonify({"message": "Invalid request: JSON object with 'url' key required"}), 400
+    if not request_data['url'].startswith(('http://', 'https://')):
+        return jsonify({"message": "Please provide a valid URL. Be sure it begins with http:// or https://"}), 400
+    interval_seconds = request_data.get('interval_seconds', 3600)
+    if not isinstance(interval_seconds, (int, float)) or isinstance(interval_seconds, bool) or not math.isfinite(interval_seconds):
+        return jsonify({"message": "Invalid request: 'interval_seconds' must be a number"}), 400
+
+    return jsonify(register_monitor(request_data['url'], interval_seconds)), 201
+
+# This endpoint lists the registered monitors.
+@app.route('/api/v1/monitors', methods=['GET'])
+@cross_origin()
+def get_monitors():
+    """Returns a JSON response: [{"id": 1, "url": "...", "interval_seconds": 3600, "last_status": "ok", ...}, {...}]."""
+    return jsonify(list_monitors()), 200
+
+# This endpoint stops monitoring a URL.
+@app.route('/api/v1/monitors/<int:monitor_id>', methods=['DELETE'])
+@cross_origin()
+def remove_monitor(monitor_id):
+    """Deletes the monitor with its stored results. Needs the admin token."""
+    if not is_admin_request():
+        return jsonify({"message": "Unauthorized: an admin token is required"}), 401
+    if not delete_monitor(monitor_id):
+        return jsonify({"message": "Monitor not found"}), 404
+    return jsonify({"message": "Monitor deleted"}), 200
+
+# This endpoint returns what changed in a monitored URL's violations.
+@app.route('/api/v1/monitors/<int:monitor_id>/changes', methods=['GET'])
+@cross_origin()
+def get_monitor_changes(monitor_id):
+    """
+    Returns the runs after the run id in ?since=, or the latest run that changed something, each with its
+    new and resolved violations: [{"id": 7, "finished": ..., "new": [{...}], "resolved": [{...}]}].
+    """
+    changes = get_changes(monitor_id, request.args.get('since', 0, type=int))
+    if changes is None:
+        return jsonify({"message": "Monitor not found"}), 404
+    return jsonify(changes), 200
+
+# This endpoint lists the saved profiles of slow requests. It needs the profiler and an admin token.
+@app.route('/api/v1/admin/profiles', methods=['GET'])
+def get_profiles():
+    """
+    Returns a JSON response: [{"name": "...", "duration_ms": 1520.3, "path": "/api/v1/html-check", "samples": 150,
+    "input": {"sha256": "...", "bytes": 5242880, ...}}, {...}].
+    """
+    settings = get_profiler_settings()
+    if not settings or not is_admin_request():
+        return jsonify({"message": "Not found"}), 404
+    return jsonify(list_profiles(settings['profile_dir'])), 200
+
+# This endpoint downloads a saved profile as collapsed stacks, the input format of flamegraph tools.
+@app.route('/api/v1/admin/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    """Returns the collapsed stacks of a profile: one "module:outer;module:inner count" line per stack."""
+    settings = get_profiler_settings()
+    if not settings or not is_admin_request() or not is_profile_name(name):
+        return jsonify({"message": "Not found"}), 404
+    return send_from_directory(os.path.abspath(settings['profile_dir']), name + '.collapsed', mimetype='text/plain', as_attachment=True)
 
 # This block ensures the Flask development server runs only when the script is executed directly.
 if __name__ == '__main__':
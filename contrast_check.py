@@ -82,6 +82,33 @@ W3C_COLORS = {
     "yellowgreen": [154, 205, 50]
 }
 
+# Pixels per absolute font-size unit
+FONT_SIZE_UNITS = {
+    "px": 1, "pt": 4 / 3, "pc": 16, "in": 96,
+    "cm": 96 / 2.54, "mm": 96 / 25.4, "q": 96 / 101.6
+}
+
+# Font-size keywords as multiples of the default (medium) font-size
+FONT_SIZE_KEYWORDS = {
+    "xx-small": 3 / 5, "x-small": 3 / 4, "small": 8 / 9, "medium": 1,
+    "large": 6 / 5, "x-large": 3 / 2, "xx-large": 2, "xxx-large": 3
+}
+
+# Browser default font-sizes of headings as multiples of the parent's font-size (em)
+HEADING_FONT_SIZES = {"h1": 2, "h2": 1.5, "h3": 1.17, "h4": 1, "h5": 0.83, "h6": 0.67}
+
+# Elements that browsers render bold by default
+BOLD_ELEMENTS = ["strong", "b", "h1", "h2", "h3", "h4", "h5", "h6"]
+
+# Start of a var() reference, e.g. "var(--brand-fg, #000000)"
+VAR_FUNCTION = re.compile(r'(?<![\w-])var\(\s*', re.IGNORECASE)
+
+# Limits of var() substitution. Like in browsers, a value whose references are nested deeper than MAX_VAR_DEPTH
+# or that grows longer than MAX_VAR_LENGTH when substituted is invalid, so a few bytes of css that reference
+# each other can't exhaust the stack or the memory.
+MAX_VAR_DEPTH = 32
+MAX_VAR_LENGTH = 64 * 1024
+
 
 def apply_styles_to_inline(html_string):
     """
@@ -129,13 +156,11 @@ def apply_styles_to_inline(html_string):
         try:
             elements_to_style = soup.select(rule['selector'])
             for element in elements_to_style:
-                existing_styles = rule['styles']
+                # Copy the rule's styles so inline styles of one element don't leak into the next
+                existing_styles = dict(rule['styles'])
                 existing_attr = element.get('style', '')
                 if existing_attr:
-                    for prop in existing_attr.split(';'):
-                        if ':' in prop:
-                            name, value = prop.split(':', 1)
-                            existing_styles[name.strip()] = value.strip()
+                    existing_styles.update(parse_style_attribute(existing_attr))
                 
                 new_style_str = '; '.join([f"{name}: {value}" for name, value in existing_styles.items()])
                 element['style'] = new_style_str
@@ -145,10 +170,27 @@ def apply_styles_to_inline(html_string):
 
     return soup
  
+def parse_style_attribute(style):
+    """Converts an inline style attribute into a dictionary of property names and values."""
+    styles = {}
+    for prop in style.split(';'):
+        if ':' in prop:
+            name, value = prop.split(':', 1)
+            name = name.strip()
+            # Custom property names are case-sensitive
+            if not name.startswith('--'):
+                name = name.lower()
+            styles[name] = value.strip()
+    return styles
+
 def parse_color(color_string):
     """Converts a color string (hex, rgb, rgba, name) to an RGBA tuple."""
     color_string = color_string.strip().lower()
 
+    # transparent is listed as black in W3C_COLORS, but it has no opacity
+    if color_string == "transparent":
+        return (0, 0, 0, 0)
+
     if color_string in W3C_COLORS:
         rgb = W3C_COLORS[color_string]
         return tuple(rgb) + (255,)
@@ -199,6 +241,269 @@ def blend_rgba_with_rgb(rgba_fg, rgb_bg):
 
     return (int(blended_r * 255), int(blended_g * 255), int(blended_b * 255))
 
+def get_background_color(styles):
+    """
+    Finds the background color declared in a dictionary of styles. Reads both the "background-color" property
+    and the "background" shorthand; if both are declared, the one declared last wins.
+
+    Returns:
+        tuple: An RGBA tuple, or None if no background color is declared.
+    """
+    for name, value in reversed(styles.items()):
+        if name == 'background-color':
+            return parse_color(value)
+        if name == 'background':
+            # The shorthand mixes the color with images, positions, etc. so look for the token that is a color.
+            for token in tinycss2.parse_component_value_list(value):
+                if token.type in ('whitespace', 'literal'):
+                    continue
+                color = parse_color(tinycss2.serialize([token]))
+                if color:
+                    return color
+            # A shorthand without a color resets the background color to transparent
+            return (0, 0, 0, 0)
+    return None
+
+def get_custom_property(scope, name, resolving=frozenset(), nesting=0):
+    """
+    Looks up a custom property (e.g. --brand-fg) in a scope and its parent scopes, resolving any var() references
+    in its value. Results are cached on the scope so each (scope, property) pair is only resolved once.
+    nesting is the number of var() references being resolved around this one.
+
+    Returns:
+        str: The resolved value, or None if the property isn't defined or can't be resolved.
+    """
+    if name in scope['resolved']:
+        return scope['resolved'][name]
+
+    # Find the closest scope that declares the property
+    declaring_scope = scope
+    while declaring_scope is not None and name not in declaring_scope['declarations']:
+        declaring_scope = declaring_scope['parent']
+
+    if declaring_scope is None:
+        value = None
+    elif declaring_scope is not scope:
+        value = get_custom_property(declaring_scope, name, resolving, nesting)
+    elif (id(scope), name) in resolving:
+        # The property references itself, directly or through other properties
+        return None
+    else:
+        value = resolve_vars(scope['declarations'][name], scope, resolving | {(id(scope), name)}, nesting)
+
+    scope['resolved'][name] = value
+    return value
+
+def resolve_vars(value, scope, resolving=frozenset(), nesting=0):
+    """
+    Replaces every var() reference in a CSS value with the value of the custom property in the given scope,
+    or with the reference's fallback if the property isn't defined.
+
+    Returns:
+        str: The value with all references replaced, or None if a reference can't be resolved, is nested deeper
+             than MAX_VAR_DEPTH or makes the value longer than MAX_VAR_LENGTH.
+    """
+    if nesting >= MAX_VAR_DEPTH:
+        return None
+
+    result = []
+    length = 0
+    position = 0
+
+    while True:
+        match = VAR_FUNCTION.search(value, position)
+        if not match:
+            result.append(value[position:])
+            return ''.join(result)
+        result.append(value[position:match.start()])
+
+        # Find the closing parenthesis and the comma separating the property name from the fallback
+        depth = 1
+        comma = None
+        index = match.end()
+        while index < len(value) and depth:
+            if value[index] == '(':
+                depth += 1
+            elif value[index] == ')':
+                depth -= 1
+            elif value[index] == ',' and depth == 1 and comma is None:
+                comma = index
+            index += 1
+        if depth:
+            return None
+
+        closing = index - 1
+        name = value[match.end():comma if comma is not None else closing].strip()
+        substitution = get_custom_property(scope, name, resolving, nesting + 1)
+        if substitution is None and comma is not None:
+            substitution = resolve_vars(value[comma + 1:closing].strip(), scope, resolving, nesting + 1)
+        if substitution is None:
+            return None
+
+        length += match.start() - position + len(substitution)
+        if length > MAX_VAR_LENGTH:
+            return None
+        result.append(substitution)
+        position = index
+
+def resolve_font_size(value, parent_size, root_size, default_size=16):
+    """
+    Converts a font-size value (px, pt and other absolute units, em, rem, %, keywords) to pixels.
+    Relative units multiply the parent's computed font-size, and rem multiplies the root element's font-size.
+
+    Returns:
+        float: The font-size in pixels, or None if it can't be determined.
+    """
+    value = value.strip().lower()
+
+    if value in FONT_SIZE_KEYWORDS:
+        return default_size * FONT_SIZE_KEYWORDS[value]
+    if value == "initial":
+        return default_size
+    if value in ("inherit", "unset"):
+        return parent_size
+
+    size_match = re.fullmatch(r'([+-]?\d*\.?\d+)\s*(px|pt|pc|in|cm|mm|q|em|rem|%)', value)
+    if not size_match:
+        if parent_size is not None and value == "larger":
+            return parent_size * 1.2
+        if parent_size is not None and value == "smaller":
+            return parent_size / 1.2
+        return None
+
+    number = float(size_match.group(1))
+    unit = size_match.group(2)
+    if unit in FONT_SIZE_UNITS:
+        return number * FONT_SIZE_UNITS[unit]
+    if unit == "rem":
+        return number * root_size if root_size is not None else None
+    if parent_size is None:
+        return None
+    if unit == "em":
+        return number * parent_size
+    return number * parent_size / 100
+
+def resolve_font_weight(value, parent_weight):
+    """Converts a font-weight value (number, keyword, bolder, lighter) to a number."""
+    value = value.strip().lower()
+
+    if value.isdigit():
+        return int(value)
+    if value == "bold":
+        return 700
+    if value == "inherit":
+        return parent_weight
+    if value == "bolder":
+        return 400 if parent_weight < 350 else 700 if parent_weight < 550 else 900
+    if value == "lighter":
+        return 100 if parent_weight < 550 else 400 if parent_weight < 750 else 700
+    return 400
+
+def compute_element_styles(name, style_attribute, parent, root_font_size, default_font_size=16):
+    """
+    Computes the styles of an element from its tag name, its style attribute and its parent's computed styles.
+
+    Returns:
+        dict: The element's computed styles (see compute_styles).
+    """
+    declared = parse_style_attribute(style_attribute)
+
+    custom_properties = {property_name: value for property_name, value in declared.items() if property_name.startswith('--')}
+    if custom_properties:
+        scope = {'parent': parent['scope'], 'declarations': custom_properties, 'resolved': {}}
+    else:
+        scope = parent['scope']
+
+    styles = {}
+    for property_name, value in declared.items():
+        if property_name.startswith('--'):
+            continue
+        if 'var(' in value.lower():
+            value = resolve_vars(value, scope)
+            # A declaration that can't be resolved is ignored, as if it wasn't declared
+            if value is None:
+                continue
+        styles[property_name] = value
+
+    color = parse_color(styles['color']) if 'color' in styles else None
+    if not color:
+        color = parent['color']
+
+    # font-weight css trumps the bold default of elements like <strong>, <b> and headings
+    if 'font-weight' in styles:
+        font_weight = resolve_font_weight(styles['font-weight'], parent['font_weight'])
+    elif name in BOLD_ELEMENTS:
+        font_weight = 700
+    else:
+        font_weight = parent['font_weight']
+
+    if 'font-size' in styles:
+        font_size = resolve_font_size(styles['font-size'], parent['font_size'], root_font_size, default_font_size)
+    elif name in HEADING_FONT_SIZES and parent['font_size'] is not None:
+        font_size = parent['font_size'] * HEADING_FONT_SIZES[name]
+    else:
+        font_size = parent['font_size']
+
+    bg_color = get_background_color(styles)
+    if not bg_color or bg_color[3] == 0:
+        background = parent['background']
+    elif bg_color[3] < 255:
+        background = blend_rgba_with_rgb(bg_color, parent['background'])
+    else:
+        background = (bg_color[0], bg_color[1], bg_color[2])
+
+    return {'styles': styles, 'color': color, 'font_weight': font_weight,
+            'font_size': font_size, 'background': background, 'scope': scope}
+
+def compute_styles(soup, default_text_color=(0, 0, 0), default_bg_color=(255, 255, 255)):
+    """
+    Computes the styles of every element in one top-down pass:
+    * Custom properties (--*) are tracked per scope as they inherit down the tree. Elements that don't declare any
+      share their parent's scope, and var() references are resolved against it.
+    * The inherited text color and font-weight of every element.
+    * The computed font-size of every element in pixels. Relative sizes multiply the parent's computed font-size,
+      so each size is only parsed once.
+    * The effective opaque background behind every element. Semi-transparent backgrounds are blended with the
+      parent's effective background, which is computed once and shared by all of its children.
+    No element has to walk back up the tree.
+
+    An element's styles only depend on its tag name, its style attribute and its parent's styles, so elements that
+    have all three in common share one computed styles dictionary. Repeated components (cards, table rows, list
+    items) are identical subtrees under the same parent styles, so only their first instance is computed.
+
+    Returns:
+        dict: Maps id(element) to a dictionary with the element's 'styles' (inline styles with var() references
+              resolved), its text 'color' as an RGBA tuple, its numeric 'font_weight', its 'font_size' in pixels
+              (None if it can't be determined) and its effective 'background' as an RGB tuple.
+    """
+    default_font_size = 16
+    root_font_size = default_font_size
+    root_scope = {'parent': None, 'declarations': {}, 'resolved': {}}
+    root = {'styles': {}, 'color': default_text_color + (255,), 'font_weight': 400,
+            'font_size': default_font_size, 'background': default_bg_color, 'scope': root_scope}
+    computed = {id(soup): root}
+
+    # Computed styles by (id of the parent's computed styles, tag name, style attribute, root font-size).
+    # The parent's computed styles are kept alive by this dictionary, so their ids are never reused.
+    shared = {}
+
+    # find_all returns elements in document order, so a parent is always computed before its children
+    for element in soup.find_all(True):
+        parent = computed.get(id(element.parent), root)
+        style_attribute = element.get('style', '')
+        key = (id(parent), element.name, style_attribute, root_font_size)
+        element_styles = shared.get(key)
+        if element_styles is None:
+            element_styles = compute_element_styles(element.name, style_attribute, parent, root_font_size, default_font_size)
+            shared[key] = element_styles
+        computed[id(element)] = element_styles
+
+        # rem units are relative to the font-size of the root element
+        if element.name == 'html' and element_styles['font_size'] is not None:
+            root_font_size = element_styles['font_size']
+
+    return computed
+
 def calculate_contrast_ratio(rgb1, rgb2):
     """Calculates the contrast ratio between two RGB colors."""
     L1 = get_relative_luminance(rgb1)
@@ -207,12 +512,64 @@ def calculate_contrast_ratio(rgb1, rgb2):
     L_dark = min(L1, L2)
     return (L_light + 0.05) / (L_dark + 0.05)
 
-def check_contrast_ratio(html_string):
+def evaluate_contrast(fg_tuple, bg_rgb, font_size, font_weight):
+    """
+    Checks the contrast of text with the given color, background, font-size and font-weight.
+
+    Returns:
+        dict: The violation details (without the element), or None if the contrast is sufficient.
     """
-    Analyzes an HTML string for color contrast violations. Unable to read font-sizes if they aren't in pixels.
+    large_text_min_ratio = 3.0 # large text min ratio 3:1
+    text_min_ratio = 4.5 # standard text min ratio 4.5:1
+
+    # default minimum ratio to standard text minimum 4.5:1
+    min_ratio = text_min_ratio
+    # unknown font-size flag
+    unknown_fs = False
+
+    if font_size is None:
+        # Cannot determine font-size, e.g. if it is in viewport units
+        unknown_fs = True
+    elif font_weight >= 700:
+        if font_size >= 18.66: # If the font is bold and bigger than 18.66px, it's considered large text
+            min_ratio = large_text_min_ratio
+    elif font_size >= 24: # Normal font is considered large if its bigger than 24px
+        min_ratio = large_text_min_ratio
+
+    # If foreground is transparent, blend it with the background
+    if fg_tuple[3] < 255:
+        final_fg_rgb = blend_rgba_with_rgb(fg_tuple, bg_rgb)
+    else:
+        final_fg_rgb = (fg_tuple[0], fg_tuple[1], fg_tuple[2])
+
+    # Calculate contrast ratio between the final opaque colors
+    ratio = calculate_contrast_ratio(final_fg_rgb, bg_rgb)
+
+    if ratio >= min_ratio:
+        return None
+
+    details = f"Unable to determine font-size. The contrast ratio is {round(ratio, 2)}. This is okay for large text (unbolded text ≥ 18 pt [~24 pixels] or bold text ≥ 14 pt [~18.66 pixels]), but the minimum required for normal text is {min_ratio}." \
+                if unknown_fs and ratio > 3 \
+                else f"The contrast ratio is {round(ratio, 2)}. The minimum required for {"normal" if min_ratio == 4.5 else "large"} text is {min_ratio}."
+    return {
+        'ratio': round(ratio, 2),
+        'foreground_color': f"rgb({final_fg_rgb[0]}, {final_fg_rgb[1]}, {final_fg_rgb[2]})",
+        'background_color': f"rgb({bg_rgb[0]}, {bg_rgb[1]}, {bg_rgb[2]})",
+        'details': details,
+    }
+
+def check_contrast_ratio(html_string, collapse_repeats=False):
+    """
+    Analyzes an HTML string for color contrast violations. Unable to read font-sizes in viewport units or calc().
     The function accounts for font-size, font-weight, and color to determine contrast ratios. 
     It will convert styles in a style tag to inline styles to determine contrast ratios.
 
+    Pages often repeat the same component (cards, table rows, list items) many times. The styles of a repeated
+    component are only computed for its first instance (see compute_styles), and the contrast of each distinct
+    combination of color, background, font-size and font-weight is only evaluated once. If collapse_repeats is
+    True, violations of repeated elements (same tag, classes and styles) are reported once, with the number of
+    instances in 'count'.
+
     Returns:
         list: A list of dictionaries, where each dictionary represents an element
               that failed the contrast check.
@@ -223,103 +580,44 @@ def check_contrast_ratio(html_string):
     default_text_color = (0, 0, 0)      # black
     default_bg_color = (255, 255, 255)  # white
 
-    large_text_min_ratio = 3.0 # large text min ratio 3:1
-    text_min_ratio = 4.5 # standard text min ratio 4.5:1
+    # Resolved and inherited styles for every element, computed once top-down
+    computed = compute_styles(soup, default_text_color, default_bg_color)
+
+    # Contrast results by fingerprint, and collapsed violations by tag, classes and fingerprint
+    evaluated = {}
+    collapsed = {}
 
     for element in soup.find_all(True):
         if not element.string:
             continue  # Skip elements without text content
 
-        # Traverse up the DOM tree to find inherited colors and font-size
-        current_element = element
-        fg_color = None
-        bg_color = None
-        font_size = None
-        font_weight = None
-
-        # default minimum ratio to standard text minimum 4.5:1
-        min_ratio = text_min_ratio
-        # unknown font-size flag
-        unknown_fs = False
-
-        while current_element and (not fg_color or not bg_color or not font_size):
-            style = current_element.get('style', '')
-            # Use regex to find color, background-color, font-size, font-weight properties
-            fg_match = re.search(r'(?<!-)color\s*:\s*([^;]+)', style)
-            bg_match = re.search(r'background-color\s*:\s*([^;]+)', style)
-            fs_match = re.search(r'font-size\s*:\s*([^;]+)', style)
-            fw_match = re.search(r'font-weight\s*:\s*([^;]+)', style)
-
-            if not fg_color and fg_match:
-                fg_color = parse_color(fg_match.group(1))
-            
-            if not bg_color and bg_match:
-                bg_color = parse_color(bg_match.group(1))
-            
-            if not font_size and fs_match:
-                font_size = fs_match.group(1)
-            
-            if not font_weight and fw_match:
-                font_weight = fw_match.group(1)
-            
-            current_element = current_element.parent
-
-        # Use default colors if none are found in the element or its parents
-        fg_tuple = fg_color if fg_color else (default_text_color[0], default_text_color[1], default_text_color[2], 255)
-        bg_tuple = bg_color if bg_color else (default_bg_color[0], default_bg_color[1], default_bg_color[2], 255)
-
-        # Convert font weight to integer. If none found, default to 400
-        if font_weight:
-            if font_weight.isdigit(): font_weight = int(font_weight)
-            elif font_weight == "bold": font_weight = 700
-            else: font_weight = 400
-        
-        # Use large text ratio if no font-size given for h1-h4 headings
-        if not font_size:
-            if element.name == "h1":
-                min_ratio = large_text_min_ratio
-            elif element.name == "h2":
-                min_ratio = large_text_min_ratio
-            elif element.name == "h3":
-                min_ratio = large_text_min_ratio
-            elif element.name == "h4":
-                min_ratio = large_text_min_ratio
-        elif "px" not in font_size:
-            # Cannot determine font-size if it is not in pixels
-            unknown_fs = True
-        else:
-            # Extract just the number to compare size
-            fs_digits = re.search(r'(\d*\.?\d+)\s*px', font_size)
-
-            #font-weight css trumps so only consider <strong> and <b> if no font-weight set
-            if (font_weight and font_weight >= 700) or (not font_weight and element.name in ["strong", "b"]):
-                if float(fs_digits.group(1)) >= 18.66: # If the font is bold and bigger than 18.66px, it's considered large text
-                    min_ratio = large_text_min_ratio
-            elif float(fs_digits.group(1)) >= 24: # Normal font is considered large if its bigger than 24px
-                min_ratio = large_text_min_ratio
+        element_styles = computed[id(element)]
+        fingerprint = (element_styles['color'], element_styles['background'], element_styles['font_size'], element_styles['font_weight'])
+        if fingerprint not in evaluated:
+            evaluated[fingerprint] = evaluate_contrast(*fingerprint)
 
+        result = evaluated[fingerprint]
+        if not result:
+            continue
 
-        # If foreground is transparent, blend it with the background
-        if fg_tuple[3] < 255:
-            final_fg_rgb = blend_rgba_with_rgb(fg_tuple, (bg_tuple[0], bg_tuple[1], bg_tuple[2]))
-        else:
-            final_fg_rgb = (fg_tuple[0], fg_tuple[1], fg_tuple[2])
-
-        # Calculate contrast ratio between the final opaque colors
-        ratio = calculate_contrast_ratio(final_fg_rgb, (bg_tuple[0], bg_tuple[1], bg_tuple[2]))
-
-        if ratio < min_ratio:
-            details = f"Unable to determine font-size. The contrast ratio is {round(ratio, 2)}. This is okay for large text (unbolded text ≥ 18 pt [~24 pixels] or bold text ≥ 14 pt [~18.66 pixels]), but the minimum required for normal text is {min_ratio}." \
-                        if unknown_fs and ratio > 3 \
-                        else f"The contrast ratio is {round(ratio, 2)}. The minimum required for {"normal" if min_ratio == 4.5 else "large"} text is {min_ratio}."
-            violations.append({
-                'problem': "Low Contrast Ratio",
-                'element': str(element).strip(),
-                'ratio': round(ratio, 2),
-                'foreground_color': f"rgb({final_fg_rgb[0]}, {final_fg_rgb[1]}, {final_fg_rgb[2]})",
-                'background_color': f"rgb({bg_tuple[0]}, {bg_tuple[1]}, {bg_tuple[2]})",
-                'details': details,
-                'rule': "COLOR_CONTRAST"
-            })
+        if collapse_repeats:
+            component = (element.name, tuple(element.get('class', [])), fingerprint)
+            if component in collapsed:
+                collapsed[component]['count'] += 1
+                continue
+
+        violation = {
+            'problem': "Low Contrast Ratio",
+            'element': str(element).strip(),
+            'ratio': result['ratio'],
+            'foreground_color': result['foreground_color'],
+            'background_color': result['background_color'],
+            'details': result['details'],
+            'rule': "COLOR_CONTRAST"
+        }
+        if collapse_repeats:
+            violation['count'] = 1
+            collapsed[component] = violation
+        violations.append(violation)
             
     return violations
@@ -0,0 +1,163 @@
+import codecs
+import gzip
+import os
+import re
+import zlib
+
+from charset_normalizer import from_bytes
+
+try:
+    import brotli
+    DECOMPRESSION_ERRORS = (zlib.error, brotli.error)
+except ImportError:
+    # br bodies are rejected and responses are only gzip-compressed without the brotli package
+    brotli = None
+    DECOMPRESSION_ERRORS = (zlib.error,)
+
+# Limiting the output of br decompression needs brotli 1.2 or newer. br bodies are rejected with older versions,
+# which could expand a small chunk to gigabytes before the size limit is checked.
+BROTLI_BODIES = brotli is not None and hasattr(brotli.Decompressor, "can_accept_more_data")
+
+
+# Size of the chunks read from request bodies
+CHUNK_SIZE = 64 * 1024
+
+# Default limit of an html body after decompression (10 MB)
+DEFAULT_MAX_HTML_BYTES = 10 * 1024 * 1024
+
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+# Byte order marks and the encodings they indicate, longest first so UTF-32 isn't mistaken for UTF-16
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32-le"), (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16-be")
+]
+
+
+class HTMLBodyError(Exception):
+    """Raised when a request body can't be read as html. status_code is the HTTP status to respond with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def get_max_html_bytes():
+    """Returns the size limit of an html body, set with the ADA_MAX_HTML_BYTES environment variable."""
+    try:
+        return int(os.environ.get("ADA_MAX_HTML_BYTES", DEFAULT_MAX_HTML_BYTES))
+    except ValueError:
+        return DEFAULT_MAX_HTML_BYTES
+
+def read_body(stream, content_encoding=None, max_bytes=None):
+    """
+    Reads a request body in chunks, decompressing gzip, deflate or br bodies as they stream in.
+    Stops as soon as the (decompressed) body is larger than max_bytes, so compressed bodies can't expand without limit.
+
+    Returns:
+        bytes: The decompressed body.
+    """
+    if max_bytes is None:
+        max_bytes = get_max_html_bytes()
+    encoding = (content_encoding or "identity").strip().lower()
+
+    if encoding == "identity":
+        decompressor = None
+    elif encoding in ("gzip", "x-gzip", "deflate"):
+        # Adding 32 to the window size detects gzip and zlib headers automatically
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+    elif encoding == "br" and BROTLI_BODIES:
+        decompressor = brotli.Decompressor()
+    else:
+        supported = "gzip, deflate or br" if BROTLI_BODIES else "gzip or deflate"
+        raise HTMLBodyError(f"Unsupported Content-Encoding '{content_encoding}'. Use {supported}.", 415)
+
+    chunks = []
+    total_bytes = 0
+
+    def append(output):
+        nonlocal total_bytes
+        total_bytes += len(output)
+        if total_bytes > max_bytes:
+            raise HTMLBodyError(f"The html is too large. The limit is {max_bytes} bytes.", 413)
+        chunks.append(output)
+
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            # Never decompress (much) more than one byte past the limit
+            if decompressor is None:
+                append(chunk)
+            elif encoding == "br":
+                append(decompressor.process(chunk, output_buffer_limit=max_bytes - total_bytes + 1))
+                # Input that didn't fit in the output buffer is kept by the decompressor until it is drained
+                while not decompressor.can_accept_more_data():
+                    append(decompressor.process(b"", output_buffer_limit=max_bytes - total_bytes + 1))
+            else:
+                append(decompressor.decompress(chunk, max_bytes - total_bytes + 1))
+
+        if decompressor is not None and encoding != "br":
+            append(decompressor.flush())
+            if not decompressor.eof:
+                raise HTMLBodyError("The compressed body is incomplete.")
+        elif encoding == "br" and not decompressor.is_finished():
+            raise HTMLBodyError("The compressed body is incomplete.")
+    except DECOMPRESSION_ERRORS:
+        raise HTMLBodyError("The body could not be decompressed.")
+
+    return b"".join(chunks)
+
+def decode_html(data, charset=None):
+    """
+    Decodes html bytes. The encoding is taken from the declared charset, then a byte order mark, then a
+    <meta charset> tag, then UTF-8, and detected from the bytes as a last resort.
+
+    Returns:
+        str: The decoded html.
+    """
+    if charset:
+        try:
+            return data.decode(codecs.lookup(charset).name, errors="replace")
+        except LookupError:
+            pass
+
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return data[len(bom):].decode(encoding, errors="replace")
+
+    meta_charset = re.search(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', data[:1024], re.IGNORECASE)
+    if meta_charset:
+        try:
+            return data.decode(codecs.lookup(meta_charset.group(1).decode("ascii")).name, errors="replace")
+        except LookupError:
+            pass
+
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+
+    best_match = from_bytes(data).best()
+    if best_match:
+        return str(best_match)
+    return data.decode("cp1252", errors="replace")
+
+def compress_body(data, accept_encodings):
+    """
+    Compresses a response body with the best encoding the client accepts.
+
+    Returns:
+        tuple: The Content-Encoding and the compressed body, or (None, data) if it isn't compressed.
+    """
+    if len(data) < MIN_COMPRESS_BYTES:
+        return None, data
+    if brotli and accept_encodings["br"]:
+        return "br", brotli.compress(data, quality=5)
+    if accept_encodings["gzip"]:
+        return "gzip", gzip.compress(data, compresslevel=6)
+    return None, data
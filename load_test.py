@@ -0,0 +1,263 @@
+"""
+Load tests the /api/v1/html-check and /api/v1/url-check endpoints.
+
+Synthetic pages of several sizes are posted to the app with a configurable number of concurrent clients.
+For the url check, a local stub server serves the same pages. The report lists the throughput and the
+p50/p95/p99 latency per endpoint and page-size bucket, plus the peak memory of this process so far when the app
+runs in it, as JSON so reports from different versions can be compared.
+
+Usage:
+    python3 load_test.py --sizes 10000 100000 1000000 --requests 50 --concurrency 8 --output report.json
+    python3 load_test.py --compare report.json
+    python3 load_test.py --target http://app-host:5000 --stub-host load-host
+
+With --target, the url check is only load tested if --stub-host gives a name or address of this machine that the
+app can reach the stub server at.
+
+Every request of a bucket sends the same page, so with ADA_CACHE_DIR set the results measure the result cache
+rather than the checks. The report notes this.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import app
+
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# A block of markup with the elements every check looks at, repeated to reach the requested page size
+PAGE_BLOCK = """
+<div class="card" style="background-color: #f0f0f0;">
+    <h2>Section {index}</h2>
+    <p style="color: #6495ED; font-size: 1.1rem;">Paragraph {index} with some text to check the contrast of.</p>
+    <img src="image-{index}.png" alt="Image {index}">
+    <a href="/page/{index}">Read more</a>
+    <span style="color: rgba(102, 111, 255, .9);">Span {index}</span>
+</div>
+"""
+
+
+def make_page(size):
+    """Builds a synthetic html page of at least size characters."""
+    head = """<html lang="en">
+<head>
+    <title>Load test</title>
+    <style>
+        .card { color: #333333; font-size: 16px; }
+        h2 { color: #777777; }
+    </style>
+</head>
+<body>
+    <h1>Load test page</h1>
+"""
+    tail = "</body>\n</html>\n"
+    blocks = []
+    length = len(head) + len(tail)
+    while length < size:
+        block = PAGE_BLOCK.format(index=len(blocks))
+        blocks.append(block)
+        length += len(block)
+    return head + "".join(blocks) + tail
+
+def percentile(sorted_values, percent):
+    """Returns the nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def get_max_rss_mb():
+    """
+    Returns the peak resident memory of this process in MB since it started. It includes the load generator's
+    payloads and responses, and it never goes down, so it isn't the peak of a single bucket.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def get_version():
+    """Returns the git commit being tested, so reports can be compared across versions."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def start_stub_server(pages, bind_address="127.0.0.1"):
+    """
+    Starts a local http server that serves the synthetic pages at /page/<size>, so the url check doesn't depend on
+    the network. Returns the server, listening on bind_address and server.server_port.
+    """
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = pages.get(self.path.rsplit("/", 1)[-1])
+            if page is None:
+                self.send_error(404)
+                return
+            body = page.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((bind_address, 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Doesn't log every request, which would slow the app down and flood the output."""
+    def log_request(self, *args, **kwargs):
+        pass
+
+def start_app_server(flask_app):
+    """Starts the Flask app on a threaded local server. Returns the server."""
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_bucket(target, endpoint, payload, num_requests, concurrency):
+    """
+    Sends num_requests identical requests to an endpoint from concurrency clients.
+
+    Returns:
+        dict: Throughput, latency percentiles in milliseconds and the number of failed requests.
+    """
+    session_local = threading.local()
+
+    def send(_):
+        if not hasattr(session_local, "session"):
+            session_local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session_local.session.post(target + endpoint, json=payload)
+            ok = response.status_code == 200 and isinstance(response.json(), list)
+        except (requests.RequestException, ValueError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(num_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, ok in results if ok)
+    return {
+        "requests": num_requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+    }
+
+def run_load_test(sizes=DEFAULT_SIZES, num_requests=50, concurrency=8, target=None, stub_host=None):
+    """
+    Load tests both endpoints with a synthetic page for each size. If no target url is given, the app is started
+    in this process and each result includes the peak memory of the whole process so far (process_peak_rss_mb).
+    Buckets run from the first size to the last, so a bucket's value may have been reached by an earlier bucket.
+    A remote app's memory isn't measured. With a target, the url check needs stub_host, the name or address the
+    app reaches this machine at; the stub server then listens on every interface. Without it, the url check is skipped.
+
+    Returns:
+        dict: The report, with one result per endpoint and page size.
+    """
+    pages = {str(size): make_page(size) for size in sizes}
+    app_server = None
+    if not target:
+        app_server = start_app_server(app)
+        target = f"http://127.0.0.1:{app_server.server_port}"
+        stub_host = "127.0.0.1"
+    stub_server = None
+    if stub_host:
+        # A remote app has to reach the stub server from another machine
+        stub_server = start_stub_server(pages, "127.0.0.1" if app_server else "0.0.0.0")
+
+    notes = []
+    if not stub_server:
+        notes.append("The url check was skipped: the app runs on another host and no --stub-host was given.")
+    if app_server and os.environ.get("ADA_CACHE_DIR"):
+        notes.append("ADA_CACHE_DIR is set, so repeated pages were answered from the result cache: the results measure the cache, not the checks.")
+    elif not app_server:
+        notes.append("The memory of the remote app wasn't measured. If it runs with ADA_CACHE_DIR set, the results measure the result cache, not the checks.")
+
+    report = {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "target": "in-process" if app_server else target,
+        "concurrency": concurrency,
+        "result_cache": bool(os.environ.get("ADA_CACHE_DIR")) if app_server else None,
+        "notes": notes,
+        "results": [],
+    }
+    try:
+        for size, page in pages.items():
+            buckets = [("/api/v1/html-check", {"html": page})]
+            if stub_server:
+                buckets.append(("/api/v1/url-check", {"url": f"http://{stub_host}:{stub_server.server_port}/page/{size}"}))
+            for endpoint, payload in buckets:
+                result = run_bucket(target, endpoint, payload, num_requests, concurrency)
+                if app_server:
+                    result["process_peak_rss_mb"] = get_max_rss_mb()
+                report["results"].append({"endpoint": endpoint, "bucket": int(size), "page_size": len(page), **result})
+    finally:
+        if stub_server:
+            stub_server.shutdown()
+        if app_server:
+            app_server.shutdown()
+
+    return report
+
+def compare_reports(old_report, new_report):
+    """Prints the change in throughput and latency between two reports, matched by endpoint and page-size bucket."""
+    old_results = {(result["endpoint"], result["bucket"]): result for result in old_report["results"]}
+    print(f"{old_report.get('version')} -> {new_report.get('version')}")
+    for result in new_report["results"]:
+        old = old_results.get((result["endpoint"], result["bucket"]))
+        if not old:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "process_peak_rss_mb"):
+            if old.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {old[key]} -> {result[key]} ({(result[key] - old[key]) / old[key]:+.1%})")
+        print(f"{result['endpoint']} {result['bucket']} chars: " + ", ".join(changes))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the html-check and url-check endpoints.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="page sizes in characters")
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint and page size")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--target", help="base url of a running app; by default the app is started in this process")
+    parser.add_argument("--stub-host", help="with --target, the name or address the app reaches this machine at, to load test the url check")
+    parser.add_argument("--output", help="file to write the JSON report to; by default it is printed")
+    parser.add_argument("--compare", help="a previous JSON report to compare the results with")
+    args = parser.parse_args()
+
+    report = run_load_test(args.sizes, args.requests, args.concurrency, args.target, args.stub_host)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    for note in report["notes"]:
+        print(f"Note: {note}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare_reports(json.load(compare_file), report)
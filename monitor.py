@@ -0,0 +1,302 @@
+"""
+Monitors registered URLs by checking them on a schedule and storing only what changed.
+
+URLs are registered with an interval. The scheduler spreads the checks out with random jitter and never runs more
+than a fixed number at once, so thousands of URLs don't arrive in bursts. The violations of each run are compared
+with the previous run, and only the new and resolved violations are stored, in a local SQLite database.
+
+Run the scheduler next to the app with:
+    python3 monitor.py --concurrency 4
+Several schedulers can share a database: each due check is claimed by exactly one of them.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+
+from http_body import HTMLBodyError, decode_html, read_body
+
+
+DEFAULT_DB_PATH = "monitor.db"
+
+# Shortest and longest allowed interval between two checks of a URL
+MIN_INTERVAL_SECONDS = 60
+MAX_INTERVAL_SECONDS = 365 * 24 * 60 * 60
+
+# Each interval is randomly lengthened or shortened by up to this fraction
+JITTER = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monitors (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    interval_seconds INTEGER NOT NULL,
+    next_run REAL NOT NULL,
+    last_run REAL,
+    last_status TEXT
+);
+CREATE TABLE IF NOT EXISTS violations (
+    monitor_id INTEGER NOT NULL REFERENCES monitors(id) ON DELETE CASCADE,
+    fingerprint TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (monitor_id, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    monitor_id INTEGER NOT NULL REFERENCES monitors(id) ON DELETE CASCADE,
+    finished REAL NOT NULL,
+    status TEXT NOT NULL,
+    new TEXT NOT NULL,
+    resolved TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS monitors_next_run ON monitors(next_run);
+CREATE INDEX IF NOT EXISTS runs_monitor ON runs(monitor_id, id);
+"""
+
+
+def get_db_path():
+    """Returns the path of the SQLite database, set with the ADA_MONITOR_DB environment variable."""
+    return os.environ.get("ADA_MONITOR_DB", DEFAULT_DB_PATH)
+
+@contextmanager
+def connect(db_path=None):
+    """Opens the database, creating the tables if needed, and commits and closes it when the block is done."""
+    conn = sqlite3.connect(db_path or get_db_path(), timeout=30)
+    try:
+        conn.row_factory = sqlite3.Row
+        # WAL lets the app read while a scheduler writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def jittered(interval_seconds):
+    """Returns the interval randomly lengthened or shortened by up to JITTER."""
+    return interval_seconds * random.uniform(1 - JITTER, 1 + JITTER)
+
+def monitor_to_dict(row):
+    """Converts a monitors row to a dictionary for JSON responses."""
+    return {
+        "id": row["id"],
+        "url": row["url"],
+        "interval_seconds": row["interval_seconds"],
+        "next_run": row["next_run"],
+        "last_run": row["last_run"],
+        "last_status": row["last_status"],
+    }
+
+def run_to_dict(row):
+    """Converts a runs row to a dictionary for JSON responses."""
+    return {
+        "id": row["id"],
+        "monitor_id": row["monitor_id"],
+        "finished": row["finished"],
+        "status": row["status"],
+        "new": json.loads(row["new"]),
+        "resolved": json.loads(row["resolved"]),
+    }
+
+def register_monitor(url, interval_seconds, db_path=None):
+    """
+    Registers a URL to be checked every interval_seconds, or updates the interval of a registered URL.
+    The interval is clamped between MIN_INTERVAL_SECONDS and MAX_INTERVAL_SECONDS.
+    The first check is at a random time within the first interval so URLs registered together are spread out.
+    When the interval of a registered URL changes, its next check is moved up to within the new interval.
+
+    Returns:
+        dict: The monitor.
+    """
+    interval_seconds = min(max(int(interval_seconds), MIN_INTERVAL_SECONDS), MAX_INTERVAL_SECONDS)
+    first_run = time.time() + random.uniform(0, interval_seconds)
+    with connect(db_path) as conn:
+        conn.execute(
+            "INSERT INTO monitors (url, interval_seconds, next_run) VALUES (?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET interval_seconds = excluded.interval_seconds, "
+            "next_run = CASE WHEN interval_seconds != excluded.interval_seconds THEN MIN(next_run, excluded.next_run) ELSE next_run END",
+            (url, interval_seconds, first_run))
+        row = conn.execute("SELECT * FROM monitors WHERE url = ?", (url,)).fetchone()
+    return monitor_to_dict(row)
+
+def list_monitors(db_path=None):
+    """Returns every registered monitor."""
+    with connect(db_path) as conn:
+        return [monitor_to_dict(row) for row in conn.execute("SELECT * FROM monitors ORDER BY id")]
+
+def delete_monitor(monitor_id, db_path=None):
+    """Deletes a monitor with its stored violations and runs. Returns False if it doesn't exist."""
+    with connect(db_path) as conn:
+        return conn.execute("DELETE FROM monitors WHERE id = ?", (monitor_id,)).rowcount > 0
+
+def get_changes(monitor_id, since_run_id=0, db_path=None):
+    """
+    Returns the runs of a monitor after since_run_id, each with its new and resolved violations.
+    If since_run_id is 0, only the latest run is returned. Returns None if the monitor doesn't exist.
+    """
+    with connect(db_path) as conn:
+        if not conn.execute("SELECT 1 FROM monitors WHERE id = ?", (monitor_id,)).fetchone():
+            return None
+        if since_run_id:
+            rows = conn.execute("SELECT * FROM runs WHERE monitor_id = ? AND id > ? ORDER BY id", (monitor_id, since_run_id))
+        else:
+            rows = conn.execute("SELECT * FROM runs WHERE monitor_id = ? ORDER BY id DESC LIMIT 1", (monitor_id,))
+        return [run_to_dict(row) for row in rows]
+
+def get_fingerprint(violation):
+    """Returns a key identifying a violation across runs. It is the violation as JSON, so it can be loaded back."""
+    return json.dumps(violation, sort_keys=True)
+
+def diff_violations(previous, current):
+    """
+    Compares the stored violations of the previous run (counts by fingerprint) with the violations of the current run.
+    Identical violations (e.g. repeated elements) are counted.
+
+    Returns:
+        tuple: The new violations and the resolved violations.
+    """
+    previous_counts = Counter(previous)
+    current_counts = Counter(get_fingerprint(violation) for violation in current)
+    violations = {get_fingerprint(violation): violation for violation in current}
+
+    new = []
+    for fingerprint, count in (current_counts - previous_counts).items():
+        new.extend([violations[fingerprint]] * count)
+    resolved = []
+    for fingerprint, count in (previous_counts - current_counts).items():
+        resolved.extend([json.loads(fingerprint)] * count)
+    return new, resolved
+
+def fetch_and_check(url, check_func):
+    """
+    Retrieves the html of a url and checks it, like the /api/v1/url-check endpoint. Pages larger than the html
+    size limit (see get_max_html_bytes) aren't checked.
+
+    Returns:
+        list: The violations, or None if the html couldn't be retrieved.
+    """
+    try:
+        response = requests.get(url, timeout=30, stream=True)
+    except requests.RequestException:
+        return None
+    try:
+        # Read the raw body so it is decompressed in chunks up to the size limit
+        data = read_body(response.raw, response.headers.get("Content-Encoding"))
+    except (HTMLBodyError, requests.RequestException, OSError):
+        return None
+    finally:
+        response.close()
+
+    content_type = response.headers.get("Content-Type", "")
+    html = decode_html(data, response.encoding if "charset" in content_type.lower() else None)
+    if "<html" not in html:
+        return None
+    return check_func(html)
+
+def run_monitor(monitor_id, url, check_func, db_path=None):
+    """Checks a monitor's url and stores the difference with the previous run."""
+    try:
+        violations = fetch_and_check(url, check_func)
+    except Exception as e:
+        # e.g. the page exceeded a sandbox limit
+        print(f"Warning: Could not check '{url}'. Error: {e}")
+        violations = None
+
+    with connect(db_path) as conn:
+        if violations is None:
+            conn.execute("UPDATE monitors SET last_run = ?, last_status = ? WHERE id = ?", (time.time(), "error", monitor_id))
+            return
+
+        previous = {
+            row["fingerprint"]: row["count"]
+            for row in conn.execute("SELECT fingerprint, count FROM violations WHERE monitor_id = ?", (monitor_id,))
+        }
+        new, resolved = diff_violations(previous, violations)
+
+        conn.execute("DELETE FROM violations WHERE monitor_id = ?", (monitor_id,))
+        counts = Counter(get_fingerprint(violation) for violation in violations)
+        conn.executemany(
+            "INSERT INTO violations (monitor_id, fingerprint, count) VALUES (?, ?, ?)",
+            [(monitor_id, fingerprint, count) for fingerprint, count in counts.items()])
+        conn.execute("UPDATE monitors SET last_run = ?, last_status = ? WHERE id = ?", (time.time(), "ok", monitor_id))
+        # Only store runs where something changed
+        if new or resolved:
+            conn.execute(
+                "INSERT INTO runs (monitor_id, finished, status, new, resolved) VALUES (?, ?, ?, ?, ?)",
+                (monitor_id, time.time(), "ok", json.dumps(new), json.dumps(resolved)))
+
+def claim_due_monitors(limit, db_path=None):
+    """
+    Claims up to limit monitors that are due, earliest first, by moving their next run forward by their
+    (jittered) interval. A monitor claimed by one scheduler isn't claimed by another.
+
+    Returns:
+        list: (id, url) tuples of the claimed monitors.
+    """
+    now = time.time()
+    claimed = []
+    with connect(db_path) as conn:
+        rows = conn.execute("SELECT id, url, interval_seconds, next_run FROM monitors WHERE next_run <= ? ORDER BY next_run LIMIT ?",
+                            (now, limit)).fetchall()
+        for row in rows:
+            # The next_run condition fails if another scheduler claimed the monitor first
+            updated = conn.execute("UPDATE monitors SET next_run = ? WHERE id = ? AND next_run = ?",
+                                   (now + jittered(row["interval_seconds"]), row["id"], row["next_run"])).rowcount
+            if updated:
+                claimed.append((row["id"], row["url"]))
+    return claimed
+
+def run_scheduler(check_func, concurrency=4, poll_seconds=1.0, db_path=None, stop_event=None):
+    """
+    Runs due monitors until stop_event is set, with at most concurrency checks at once.
+    """
+    stop_event = stop_event or threading.Event()
+    running = [0]
+    lock = threading.Lock()
+
+    def run(monitor_id, url):
+        try:
+            run_monitor(monitor_id, url, check_func, db_path)
+        except Exception as e:
+            print(f"Warning: Could not check '{url}'. Error: {e}")
+        finally:
+            with lock:
+                running[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while not stop_event.is_set():
+            # Only claim as many monitors as can run now, so the others stay due for other schedulers
+            with lock:
+                free = concurrency - running[0]
+            claimed = claim_due_monitors(free, db_path) if free else []
+            for monitor_id, url in claimed:
+                with lock:
+                    running[0] += 1
+                executor.submit(run, monitor_id, url)
+            if not claimed:
+                stop_event.wait(poll_seconds)
+
+if __name__ == '__main__':
+    from app import run_checks
+    from sandbox import get_sandbox_pool
+
+    parser = argparse.ArgumentParser(description="Check registered URLs on a schedule and store the changes.")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of checks at once")
+    parser.add_argument("--db", help="path of the SQLite database; defaults to ADA_MONITOR_DB or monitor.db")
+    args = parser.parse_args()
+
+    # Run the checks in the sandbox if it is enabled (ADA_SANDBOX=1), so a hostile page can't stall the scheduler
+    pool = get_sandbox_pool(run_checks)
+    try:
+        run_scheduler(pool.run if pool else run_checks, args.concurrency, db_path=args.db)
+    except KeyboardInterrupt:
+        pass
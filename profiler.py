@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# Defaults of the settings, which can be set with environment variables (see get_profiler_settings)
+DEFAULT_THRESHOLD_MS = 1000
+DEFAULT_INTERVAL_MS = 10
+DEFAULT_MAX_PROFILES = 50
+
+# Profile names are generated by save_profile; anything else is rejected so names can't escape the directory
+PROFILE_NAME = re.compile(r'\d+-[0-9a-f]{12}')
+
+
+def get_profiler_settings():
+    """
+    Returns the settings of the profiler, or None if it is disabled. The profiler is enabled by setting the
+    ADA_PROFILE_DIR environment variable to the directory profiles are saved in. ADA_PROFILE_THRESHOLD_MS,
+    ADA_PROFILE_INTERVAL_MS and ADA_PROFILE_MAX_FILES override the defaults.
+    """
+    profile_dir = os.environ.get("ADA_PROFILE_DIR")
+    if not profile_dir:
+        return None
+
+    def get_int(name, default):
+        try:
+            return int(os.environ.get(name, default))
+        except ValueError:
+            return default
+
+    return {
+        "profile_dir": profile_dir,
+        "threshold_ms": get_int("ADA_PROFILE_THRESHOLD_MS", DEFAULT_THRESHOLD_MS),
+        "interval_ms": get_int("ADA_PROFILE_INTERVAL_MS", DEFAULT_INTERVAL_MS),
+        "max_profiles": get_int("ADA_PROFILE_MAX_FILES", DEFAULT_MAX_PROFILES),
+    }
+
+class StackSampler:
+    """
+    Samples the stacks of the threads that are being profiled from a single background thread, so the cost of
+    profiling doesn't depend on the number of requests. Samples are kept as collapsed stacks
+    ("module:outer_function;module:inner_function" -> number of samples).
+    """
+
+    def __init__(self, interval_ms=DEFAULT_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, thread_id):
+        """Starts sampling a thread."""
+        with self.lock:
+            self.samples[thread_id] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+                self.thread.start()
+
+    def stop(self, thread_id):
+        """Stops sampling a thread. Returns its samples."""
+        with self.lock:
+            return self.samples.pop(thread_id, Counter())
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            # Walk the stacks without holding the lock, so starting and stopping requests never wait for them
+            with self.lock:
+                profiled = list(self.samples.items())
+            if not profiled:
+                continue
+            frames = sys._current_frames()
+            stacks = [(thread_id, counter, collapse_stack(frames[thread_id])) for thread_id, counter in profiled if thread_id in frames]
+            del frames
+            with self.lock:
+                for thread_id, counter, stack in stacks:
+                    # Skip threads that stopped (and maybe started a new request) while the stacks were walked
+                    if self.samples.get(thread_id) is counter:
+                        counter[stack] += 1
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def get_sampler(interval_ms):
+    """Returns the shared stack sampler, creating it on first use."""
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler(interval_ms)
+    return _sampler
+
+def collapse_stack(frame):
+    """Converts a frame and its callers to a collapsed stack: "module:function;module:function", outermost first."""
+    stack = []
+    while frame is not None:
+        stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+def get_input_stats(input_string):
+    """Returns the content hash and size statistics of an html string, to find the input of a slow request."""
+    data = input_string.encode("utf-8", "surrogatepass")
+    return {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "characters": len(input_string),
+        "bytes": len(data),
+        "tags": input_string.count("<"),
+        "style_characters": count_style_characters(input_string),
+    }
+
+def count_style_characters(input_string):
+    """
+    Returns the number of characters inside <style> tags. It scans the html once, since a regular expression
+    backtracks for a very long time on unclosed <style> tags.
+    """
+    lowered = input_string.lower()
+    total = 0
+    position = 0
+    while True:
+        start = lowered.find("<style", position)
+        if start == -1:
+            return total
+        content_start = lowered.find(">", start) + 1
+        if content_start == 0:
+            return total
+        end = lowered.find("</style", content_start)
+        if end == -1:
+            return total
+        total += end - content_start
+        position = end + len("</style")
+
+def save_profile(profile_dir, samples, metadata, max_profiles=DEFAULT_MAX_PROFILES):
+    """
+    Saves the samples of a request as a collapsed-stack file (<name>.collapsed), which flamegraph.pl, inferno and
+    speedscope can turn into a flamegraph, and the request details as <name>.json.
+    Only the newest max_profiles profiles are kept.
+
+    Returns:
+        str: The name of the profile.
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    input_hash = (metadata.get("input") or {}).get("sha256") or hashlib.sha256(metadata.get("path", "").encode()).hexdigest()
+    name = f"{time.time_ns()}-{input_hash[:12]}"
+
+    with open(os.path.join(profile_dir, name + ".collapsed"), "w") as collapsed_file:
+        for stack, count in samples.most_common():
+            collapsed_file.write(f"{stack} {count}\n")
+    with open(os.path.join(profile_dir, name + ".json"), "w") as metadata_file:
+        json.dump({"name": name, "samples": sum(samples.values()), **metadata}, metadata_file)
+
+    # Delete the oldest profiles past the limit
+    for old_name in list_profile_names(profile_dir)[max_profiles:]:
+        for extension in (".collapsed", ".json"):
+            try:
+                os.remove(os.path.join(profile_dir, old_name + extension))
+            except OSError:
+                pass
+    return name
+
+def list_profile_names(profile_dir):
+    """Returns the names of the saved profiles, newest first."""
+    if not os.path.isdir(profile_dir):
+        return []
+    names = [file_name[:-len(".json")] for file_name in os.listdir(profile_dir) if file_name.endswith(".json")]
+    return sorted((name for name in names if PROFILE_NAME.fullmatch(name)), key=lambda name: int(name.split("-")[0]), reverse=True)
+
+def list_profiles(profile_dir):
+    """Returns the details of the saved profiles, newest first."""
+    profiles = []
+    for name in list_profile_names(profile_dir):
+        try:
+            with open(os.path.join(profile_dir, name + ".json")) as metadata_file:
+                profiles.append(json.load(metadata_file))
+        except (OSError, ValueError):
+            # Deleted by another worker in the meantime
+            continue
+    return profiles
+
+def is_profile_name(name):
+    """Returns True if name is a valid profile name."""
+    return bool(PROFILE_NAME.fullmatch(name))
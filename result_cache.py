@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # fcntl is only available on Unix. Without it, eviction isn't serialized between processes,
+    # which only means two workers may evict at the same time.
+    fcntl = None
+
+
+# Bump this when the format of the results changes so old entries are ignored
+CACHE_VERSION = "2"
+
+# Default size limit of the cache directory (64 MB)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def get_cache_dir():
+    """
+    Returns the directory shared by all worker processes, or None if caching is disabled.
+    Caching is enabled by setting the ADA_CACHE_DIR environment variable, ideally to a memory-backed
+    directory such as /dev/shm/ada-cache so entries never touch the disk.
+    """
+    cache_dir = os.environ.get("ADA_CACHE_DIR")
+    if not cache_dir:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def get_max_bytes():
+    """Returns the size limit of the cache directory, set with the ADA_CACHE_MAX_BYTES environment variable."""
+    try:
+        return int(os.environ.get("ADA_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+    except ValueError:
+        return DEFAULT_MAX_BYTES
+
+def get_cache_path(cache_dir, input_string, variant=""):
+    """
+    Returns the path of the cache entry for an html string, named after its content hash.
+    The variant tells apart results of the same html checked with different options.
+    """
+    digest = hashlib.sha256(input_string.encode("utf-8", "surrogatepass")).hexdigest()
+    suffix = f"-{variant}" if variant else ""
+    return os.path.join(cache_dir, f"v{CACHE_VERSION}-{digest}{suffix}.json")
+
+def get_cached_result(input_string, variant=""):
+    """
+    Looks up the accessibility check results of an html string, which may have been stored by any worker process.
+
+    Returns:
+        list: The cached violations, or None if the html string isn't cached.
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return None
+
+    path = get_cache_path(cache_dir, input_string, variant)
+    try:
+        with open(path, "r", encoding="utf-8") as cache_file:
+            result = json.load(cache_file)
+        # Mark the entry as recently used so it is evicted last
+        os.utime(path)
+    except (OSError, ValueError):
+        # Missing, just evicted by another worker, or unreadable
+        return None
+    return result
+
+def store_result(input_string, result, variant=""):
+    """
+    Stores the accessibility check results of an html string so every worker process can reuse them.
+    The entry is written to a temporary file and renamed into place, so readers never see a partial entry.
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return
+
+    path = get_cache_path(cache_dir, input_string, variant)
+    temp_path = None
+    try:
+        try:
+            replaced_bytes = os.path.getsize(path)
+        except OSError:
+            replaced_bytes = 0
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+            json.dump(result, temp_file)
+        added_bytes = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+    except OSError as e:
+        # Don't leave the partial entry behind, e.g. when the cache directory is full
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        print(f"Warning: Could not write to the result cache. Error: {e}")
+        return
+
+    update_size(cache_dir, added_bytes - replaced_bytes, get_max_bytes())
+
+def update_size(cache_dir, delta_bytes, max_bytes):
+    """
+    Adds delta_bytes to the running size of the cache directory, which is kept in its .size file so a store
+    doesn't have to scan the directory. Only when the size is over max_bytes (or unknown) is the directory
+    scanned and the least recently used entries evicted.
+    """
+    with open(os.path.join(cache_dir, ".lock"), "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        size_path = os.path.join(cache_dir, ".size")
+        try:
+            with open(size_path, "r") as size_file:
+                total_bytes = int(size_file.read()) + delta_bytes
+        except (OSError, ValueError):
+            total_bytes = None
+
+        if total_bytes is None or total_bytes > max_bytes:
+            total_bytes = evict(cache_dir, max_bytes)
+
+        with open(size_path, "w") as size_file:
+            size_file.write(str(total_bytes))
+
+def evict(cache_dir, max_bytes):
+    """
+    Deletes the least recently used entries until the cache directory is within its size limit.
+    Must be called with the cache lock held.
+
+    Returns:
+        int: The size of the remaining entries in bytes.
+    """
+    entries = []
+    total_bytes = 0
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes += stat.st_size
+
+    if total_bytes <= max_bytes:
+        return total_bytes
+
+    # Oldest first
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        if total_bytes <= max_bytes:
+            break
+    return total_bytes
@@ -0,0 +1,194 @@
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+
+try:
+    import resource
+except ImportError:
+    # resource limits are only available on Unix
+    resource = None
+
+
+# Defaults of the limits, which can be set with environment variables (see get_sandbox_settings)
+DEFAULT_CPU_SECONDS = 10
+DEFAULT_MEMORY_MB = 512
+DEFAULT_TASKS_PER_WORKER = 100
+
+
+class ResourceLimitError(Exception):
+    """Raised when a check exceeds its CPU time, memory or recursion limit. limit names the limit that was exceeded."""
+
+    def __init__(self, limit):
+        super().__init__(f"The {limit} limit was exceeded.")
+        self.limit = limit
+
+
+class WorkerError(Exception):
+    """Raised when a task can't be given to a worker process, e.g. because a fresh worker dies on start."""
+
+
+def get_sandbox_settings():
+    """
+    Returns the settings of the sandbox, or None if it is disabled. The sandbox is enabled by setting the
+    ADA_SANDBOX environment variable to 1. ADA_SANDBOX_WORKERS, ADA_SANDBOX_CPU_SECONDS, ADA_SANDBOX_MEMORY_MB and
+    ADA_SANDBOX_TASKS_PER_WORKER override the defaults.
+    """
+    if os.environ.get("ADA_SANDBOX", "").lower() not in ("1", "true", "yes"):
+        return None
+    if resource is None:
+        print("Warning: The sandbox needs resource limits, which are not available on this platform.")
+        return None
+
+    def get_int(name, default):
+        try:
+            return int(os.environ.get(name, default))
+        except ValueError:
+            return default
+
+    return {
+        "workers": get_int("ADA_SANDBOX_WORKERS", os.cpu_count() or 2),
+        "cpu_seconds": get_int("ADA_SANDBOX_CPU_SECONDS", DEFAULT_CPU_SECONDS),
+        "memory_bytes": get_int("ADA_SANDBOX_MEMORY_MB", DEFAULT_MEMORY_MB) * 1024 * 1024,
+        "tasks_per_worker": get_int("ADA_SANDBOX_TASKS_PER_WORKER", DEFAULT_TASKS_PER_WORKER),
+    }
+
+def worker_main(conn, func, cpu_seconds, memory_bytes):
+    """
+    Runs tasks received on conn until the pipe is closed. Each task gets cpu_seconds of CPU time on top of what the
+    worker has used so far; when it runs out, the kernel kills the worker with SIGXCPU. The worker's address space
+    is capped at memory_bytes, so allocations past it raise MemoryError.
+    """
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    _, cpu_hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_limit = math.ceil(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        if cpu_hard_limit != resource.RLIM_INFINITY:
+            cpu_limit = min(cpu_limit, cpu_hard_limit)
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_hard_limit))
+
+        try:
+            conn.send(("ok", func(*args)))
+        except MemoryError:
+            conn.send(("limit", "memory"))
+            # The heap may be fragmented, so let the pool replace this worker
+            return
+        except RecursionError:
+            conn.send(("limit", "recursion"))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+class SandboxPool:
+    """
+    A pool of worker processes that run func with per-task CPU time and memory limits. A worker that exceeds a
+    limit, stops responding or has run tasks_per_worker tasks is replaced with a fresh one, so one pathological
+    document can't stall or take down the process serving other requests.
+    """
+
+    def __init__(self, func, workers, cpu_seconds, memory_bytes, tasks_per_worker=DEFAULT_TASKS_PER_WORKER):
+        self.func = func
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.tasks_per_worker = tasks_per_worker
+        # forkserver doesn't fork the (possibly multithreaded) web server process itself
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.context = multiprocessing.get_context(start_method)
+        self.idle_workers = queue.Queue()
+        for _ in range(workers):
+            self.idle_workers.put(self.start_worker())
+
+    def start_worker(self):
+        """Starts a worker process. Returns a dictionary with the process, its pipe and its number of tasks."""
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(child_conn, self.func, self.cpu_seconds, self.memory_bytes), daemon=True)
+        process.start()
+        child_conn.close()
+        return {"process": process, "conn": parent_conn, "tasks": 0}
+
+    def stop_worker(self, worker):
+        """Closes a worker's pipe and kills it if it doesn't exit."""
+        worker["conn"].close()
+        worker["process"].join(timeout=1)
+        if worker["process"].is_alive():
+            worker["process"].kill()
+            worker["process"].join()
+
+    def run(self, *args):
+        """
+        Runs func(*args) in a worker process.
+
+        Returns:
+            The return value of func.
+
+        Raises:
+            ResourceLimitError: If the task exceeded the CPU time, memory or recursion limit.
+            WorkerError: If no worker process could take the task.
+        """
+        worker = self.idle_workers.get()
+        replace = True
+        try:
+            try:
+                worker["conn"].send(args)
+            except (BrokenPipeError, ConnectionResetError):
+                # The worker died while it was idle, so the task never reached it. Give it to a fresh worker.
+                self.stop_worker(worker)
+                worker = self.start_worker()
+                try:
+                    worker["conn"].send(args)
+                except (BrokenPipeError, ConnectionResetError):
+                    raise WorkerError("The worker process exited before it could run the task.")
+            worker["tasks"] += 1
+            # The CPU limit kills the worker, but also give up if it is blocked without using CPU
+            if not worker["conn"].poll(self.cpu_seconds * 2 + 5):
+                raise ResourceLimitError("time")
+            try:
+                status, value = worker["conn"].recv()
+            except (EOFError, ConnectionResetError):
+                # The worker was killed, either by the CPU limit or because it ran out of memory outside Python
+                worker["process"].join(timeout=1)
+                raise ResourceLimitError("cpu" if worker["process"].exitcode == -signal.SIGXCPU else "memory")
+
+            if status == "limit":
+                raise ResourceLimitError(value)
+            replace = worker["tasks"] >= self.tasks_per_worker
+            if status == "error":
+                raise RuntimeError(value)
+            return value
+        finally:
+            if replace:
+                self.stop_worker(worker)
+                worker = self.start_worker()
+            self.idle_workers.put(worker)
+
+    def close(self):
+        """Stops the idle workers."""
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                return
+            self.stop_worker(worker)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_sandbox_pool(func):
+    """Returns the shared pool running func, starting it on first use, or None if the sandbox is disabled."""
+    global _pool
+    if _pool is None:
+        settings = get_sandbox_settings()
+        if not settings:
+            return None
+        with _pool_lock:
+            if _pool is None:
+                _pool = SandboxPool(func, **settings)
+    return _pool
@@ -1,7 +1,21 @@
 import unittest
+import gzip
+import io
 import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 from flask import Flask, jsonify, request
-from app import app
+from app import app, run_checks
+import contrast_check
+import http_body
+import load_test
+import monitor
+import profiler
+import result_cache
+import sandbox
 
 # --- The Flask Application to be tested ---
 
@@ -39,6 +53,19 @@ from app import app
     
 #     return jsonify({"message": "Item added successfully", "item": item}), 201
 
+def pathological_checks(input_string, collapse_repeats=False):
+    """Runs the checks in the sandbox, but spins forever for "<cpu>" and allocates 4 GB for "<memory>"."""
+    if input_string == "<cpu>":
+        while True:
+            pass
+    if input_string == "<memory>":
+        bytearray(4 * 1024 * 1024 * 1024)
+    return run_checks(input_string, collapse_repeats)
+
+def fake_page(html):
+    """Returns a mock response of requests.get(url, stream=True) serving html."""
+    return mock.Mock(raw=io.BytesIO(html.encode("utf-8")), headers={"Content-Type": "text/html; charset=utf-8"}, encoding="utf-8")
+
 # --- The Unit Test Class ---
 class TestAPIEndpoints(unittest.TestCase):
     """
@@ -272,7 +299,7 @@ class TestAPIEndpoints(unittest.TestCase):
                                 </div>
                                 <div id="intro">
                                     <p class="test">This paragraph has good contrast.</p>
-                                    <span style='color: rgba(102, 111, 255, .9); font-size: 20em;' class="test">This span's font size can't be determined.</span>
+                                    <span style='color: rgba(102, 111, 255, .9); font-size: 20vw;' class="test">This span's font size can't be determined.</span>
                                 </div>
                             </body>
                             </html>
@@ -292,7 +319,7 @@ class TestAPIEndpoints(unittest.TestCase):
         },
         {
             "background_color": "rgb(135, 206, 250)",
-            "details": "The contrast ratio is 1.83. The minimum required for normal text is 4.5.",
+            "details": "The contrast ratio is 1.83. The minimum required for large text is 3.0.",
             "element": "<span style=\"color: rgb(255,0,255); font-size: 20em;\">This span also has poor contrast.</span>",
             "foreground_color": "rgb(255, 0, 255)",
             "problem": "Low Contrast Ratio",
@@ -302,13 +329,566 @@ class TestAPIEndpoints(unittest.TestCase):
         {
             "background_color": "rgb(240, 240, 240)",
             "details": "Unable to determine font-size. The contrast ratio is 3.05. This is okay for large text (unbolded text ≥ 18 pt [~24 pixels] or bold text ≥ 14 pt [~18.66 pixels]), but the minimum required for normal text is 4.5.",
-            "element": "<span class=\"test\" style=\"color: rgba(102, 111, 255, .9); font-size: 20em; font-weight: 700\">This span's font size can't be determined.</span>",
+            "element": "<span class=\"test\" style=\"color: rgba(102, 111, 255, .9); font-size: 20vw; font-weight: 700\">This span's font size can't be determined.</span>",
             "foreground_color": "rgb(116, 124, 253)",
             "problem": "Low Contrast Ratio",
             "ratio": 3.05,
             "rule": "COLOR_CONTRAST"
         }])
 
+    def test_contrast_background_blending(self):
+        """Test the /api/v1/html-check endpoint blends semi-transparent backgrounds and reads the background shorthand."""
+        html_string = { "html": """
+                            <html lang="en">
+                            <head>
+                                <title>Test</title>
+                            </head>
+                            <body style="background: url(bg.png) no-repeat #000000;">
+                                <div style="background-color: rgba(255, 255, 255, 0.5);">
+                                    <h1>Heading</h1>
+                                    <p style="color: #777777;">This paragraph is on a half white background.</p>
+                                </div>
+                                <div style="background: transparent;">
+                                    <p style="color: #ffffff;">This paragraph has good contrast.</p>
+                                    <p style="color: #333333;">This paragraph is on a black background.</p>
+                                </div>
+                            </body>
+                            </html>
+                       """}
+        response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "application/json")
+        data = json.loads(response.data)
+        self.assertEqual(data, [{
+            "background_color": "rgb(127, 127, 127)",
+            "details": "The contrast ratio is 1.12. The minimum required for normal text is 4.5.",
+            "element": "<p style=\"color: #777777;\">This paragraph is on a half white background.</p>",
+            "foreground_color": "rgb(119, 119, 119)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 1.12,
+            "rule": "COLOR_CONTRAST"
+        },
+        {
+            "background_color": "rgb(0, 0, 0)",
+            "details": "The contrast ratio is 1.66. The minimum required for normal text is 4.5.",
+            "element": "<p style=\"color: #333333;\">This paragraph is on a black background.</p>",
+            "foreground_color": "rgb(51, 51, 51)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 1.66,
+            "rule": "COLOR_CONTRAST"
+        }])
+
+    def test_contrast_custom_properties(self):
+        """Test the /api/v1/html-check endpoint resolves custom properties and var() fallbacks."""
+        html_string = { "html": """
+                            <html lang="en">
+                            <head>
+                                <title>Test</title>
+                                <style>
+                                    :root {
+                                        --brand-fg: #777777;
+                                        --brand-bg: #ffffff;
+                                    }
+                                    .card {
+                                        background-color: var(--card-bg, var(--brand-bg));
+                                        color: var(--brand-fg);
+                                    }
+                                    .dark {
+                                        --card-bg: #000000;
+                                    }
+                                </style>
+                            </head>
+                            <body>
+                                <div class="card">
+                                    <p>This paragraph is on the brand background.</p>
+                                </div>
+                                <div class="card dark">
+                                    <p style="color: var(--missing-fg, #333333);">This paragraph is on a dark card.</p>
+                                </div>
+                            </body>
+                            </html>
+                       """}
+        response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "application/json")
+        data = json.loads(response.data)
+        self.assertEqual(data, [{
+            "background_color": "rgb(255, 255, 255)",
+            "details": "The contrast ratio is 4.48. The minimum required for normal text is 4.5.",
+            "element": "<p>This paragraph is on the brand background.</p>",
+            "foreground_color": "rgb(119, 119, 119)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 4.48,
+            "rule": "COLOR_CONTRAST"
+        },
+        {
+            "background_color": "rgb(0, 0, 0)",
+            "details": "The contrast ratio is 1.66. The minimum required for normal text is 4.5.",
+            "element": "<p style=\"color: var(--missing-fg, #333333);\">This paragraph is on a dark card.</p>",
+            "foreground_color": "rgb(51, 51, 51)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 1.66,
+            "rule": "COLOR_CONTRAST"
+        }])
+
+    def test_contrast_custom_property_limits(self):
+        """Test the /api/v1/html-check endpoint treats var() chains that are too deep or grow too long as invalid."""
+        long_chain = "; ".join(f"--c{index}: var(--c{index + 1})" for index in range(2000)) + "; --c2000: #eeeeee"
+        short_chain = "; ".join(f"--s{index}: var(--s{index + 1})" for index in range(5)) + "; --s5: #eeeeee"
+        doubling = "--v0: #eeeeee; " + "; ".join(f"--v{index}: var(--v{index - 1}) var(--v{index - 1})" for index in range(1, 40))
+        html_string = { "html": f"""<html lang="en"><head><title>T</title></head><body style="{long_chain}; {short_chain}; {doubling}">
+                                    <p style="color: var(--c0);">Long chain</p>
+                                    <p style="color: var(--s0);">Short chain</p>
+                                    <p style="color: var(--v39);">Doubling</p>
+                                    </body></html>"""}
+        response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([violation["element"] for violation in data], ["<p style=\"color: var(--s0);\">Short chain</p>"])
+
+    def test_contrast_font_size_units(self):
+        """Test the /api/v1/html-check endpoint resolves em, rem, %, pt and keyword font-sizes."""
+        html_string = { "html": """
+                            <html lang="en" style="font-size: 20px;">
+                            <head>
+                                <title>Test</title>
+                            </head>
+                            <body style="color: #949494;">
+                                <p style="font-size: 1.2rem;">This paragraph is large text.</p>
+                                <p style="font-size: 1rem;">This paragraph is normal text.</p>
+                                <div style="font-size: 0.5em;">
+                                    <p style="font-size: 300%;">This paragraph is large text.</p>
+                                </div>
+                                <p style="font-size: 14pt; font-weight: bold;">This paragraph is large bold text.</p>
+                                <p style="font-size: x-large;">This paragraph is large text.</p>
+                                <h1 style="font-size: 0.5em;">Heading</h1>
+                            </body>
+                            </html>
+                       """}
+        response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "application/json")
+        data = json.loads(response.data)
+        self.assertEqual(data, [{
+            "background_color": "rgb(255, 255, 255)",
+            "details": "The contrast ratio is 3.03. The minimum required for normal text is 4.5.",
+            "element": "<p style=\"font-size: 1rem;\">This paragraph is normal text.</p>",
+            "foreground_color": "rgb(148, 148, 148)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 3.03,
+            "rule": "COLOR_CONTRAST"
+        },
+        {
+            "background_color": "rgb(255, 255, 255)",
+            "details": "The contrast ratio is 3.03. The minimum required for normal text is 4.5.",
+            "element": "<h1 style=\"font-size: 0.5em;\">Heading</h1>",
+            "foreground_color": "rgb(148, 148, 148)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 3.03,
+            "rule": "COLOR_CONTRAST"
+        }])
+
+    def test_result_cache(self):
+        """Test the /api/v1/html-check endpoint stores results in the shared cache and reuses them."""
+        html_string = { "html": "<html lang=\"en\"><head><title>T</title></head><body><a href=\"#\">Click here</a></body></html>"}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ["ADA_CACHE_DIR"] = cache_dir
+            try:
+                first = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+                self.assertEqual(len([name for name in os.listdir(cache_dir) if name.endswith(".json")]), 1)
+
+                # A result stored by another worker is returned without checking the html again
+                result_cache.store_result(html_string["html"], [{"rule": "CACHED"}])
+                second = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+
+                # Storing past the size limit evicts the least recently used entries
+                os.environ["ADA_CACHE_MAX_BYTES"] = "200"
+                for index in range(10):
+                    result_cache.store_result(f"<html>{index}</html>", [{"rule": "CACHED", "index": index}])
+                entry_sizes = [os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir) if name.endswith(".json")]
+                with open(os.path.join(cache_dir, ".size")) as size_file:
+                    stored_size = int(size_file.read())
+            finally:
+                del os.environ["ADA_CACHE_DIR"]
+                os.environ.pop("ADA_CACHE_MAX_BYTES", None)
+        self.assertEqual(json.loads(first.data)[0]["rule"], "LINK_GENERIC_TEXT")
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(json.loads(second.data), [{"rule": "CACHED"}])
+        self.assertLessEqual(sum(entry_sizes), 200)
+        self.assertEqual(stored_size, sum(entry_sizes))
+
+    def test_raw_html(self):
+        """Test the /api/v1/html-check endpoint for a raw text/html body in a declared charset."""
+        html_string = "<html lang=\"en\"><head><title>Café</title></head><body><a href=\"#\">Click here</a></body></html>"
+        response = self.app.post('/api/v1/html-check', data=html_string.encode("iso-8859-1"), content_type="text/html; charset=iso-8859-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "application/json")
+        data = json.loads(response.data)
+        self.assertEqual(data, [{
+            "details": "Link text should be descriptive. Avoid \"Click here.\"",
+            "element": "<a href=\"#\">Click here</a>",
+            "problem": "Generic Link Text",
+            "rule": "LINK_GENERIC_TEXT"
+        }])
+
+    def test_compressed_html(self):
+        """Test the /api/v1/html-check endpoint for a gzip-compressed body and a gzip-compressed response."""
+        html_string = "<html lang=\"en\"><head><title>T</title></head><body>" + "<a href=\"#\">Click here</a>" * 20 + "</body></html>"
+        response = self.app.post('/api/v1/html-check', data=gzip.compress(html_string.encode("utf-8")), content_type="text/html",
+                                 headers={"Content-Encoding": "gzip", "Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(response.data))
+        self.assertEqual(len(data), 20)
+        self.assertEqual(data[0]["rule"], "LINK_GENERIC_TEXT")
+
+    def test_compressed_html_too_large(self):
+        """Test the /api/v1/html-check endpoint stops decompressing a body that is over the size limit."""
+        os.environ["ADA_MAX_HTML_BYTES"] = "1000"
+        try:
+            response = self.app.post('/api/v1/html-check', data=gzip.compress(b" " * 100000), content_type="text/html",
+                                     headers={"Content-Encoding": "gzip"})
+        finally:
+            del os.environ["ADA_MAX_HTML_BYTES"]
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(json.loads(response.data), {"message": "The html is too large. The limit is 1000 bytes."})
+
+    @unittest.skipUnless(http_body.BROTLI_BODIES, "needs brotli 1.2 or newer")
+    def test_brotli_html_too_large(self):
+        """Test the /api/v1/html-check endpoint stops decompressing a br body that is over the size limit."""
+        import brotli
+        os.environ["ADA_MAX_HTML_BYTES"] = "1000"
+        try:
+            response = self.app.post('/api/v1/html-check', data=brotli.compress(b" " * 10000000), content_type="text/html",
+                                     headers={"Content-Encoding": "br"})
+        finally:
+            del os.environ["ADA_MAX_HTML_BYTES"]
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(json.loads(response.data), {"message": "The html is too large. The limit is 1000 bytes."})
+
+    def test_html_too_large(self):
+        """Test the /api/v1/html-check endpoint applies the size limit to plain JSON bodies and multipart uploads."""
+        os.environ["ADA_MAX_HTML_BYTES"] = "1000"
+        try:
+            json_response = self.app.post('/api/v1/html-check', data=json.dumps({"html": " " * 2000}), content_type="application/json")
+            upload_response = self.app.post('/api/v1/html-check', data={"html": (io.BytesIO(b" " * 200000), "page.html")}, content_type="multipart/form-data")
+        finally:
+            del os.environ["ADA_MAX_HTML_BYTES"]
+        for response in (json_response, upload_response):
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(json.loads(response.data), {"message": "The html is too large. The limit is 1000 bytes."})
+
+    def test_html_upload(self):
+        """Test the /api/v1/html-check endpoint for a multipart html file upload."""
+        html_string = b"<html lang=\"en\"><head><title>T</title></head><body><img src=\"src\"></body></html>"
+        response = self.app.post('/api/v1/html-check', data={"html": (io.BytesIO(html_string), "page.html")}, content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "application/json")
+        data = json.loads(response.data)
+        self.assertEqual(data, [{
+            "details": "Informative images must have a descriptive 'alt' attribute.",
+            "element": "<img src=\"src\">",
+            "problem": "Missing 'alt' Text",
+            "rule": "IMG_ALT_MISSING"
+        }])
+
+    def test_contrast_repeated_components(self):
+        """Test the /api/v1/html-check endpoint collapses contrast violations of repeated components when asked to."""
+        card = """<div class="card"><p class="price" style="color: #999999;">$10</p><p>Details</p></div>"""
+        html_string = { "html": "<html lang=\"en\"><head><title>T</title></head><body>" + card * 3 + "<p style=\"color: #aaaaaa;\">Footer</p></body></html>"}
+        # The styles of the 2nd and 3rd card (and their children) are shared with the 1st instead of computed again
+        with mock.patch("contrast_check.compute_element_styles", wraps=contrast_check.compute_element_styles) as compute_element_styles:
+            response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(len(data), 4)
+        # html, head, title, body, the 1st card's div and 2 p's, and the footer p
+        self.assertEqual(compute_element_styles.call_count, 8)
+
+        response = self.app.post('/api/v1/html-check?collapse=true', data=json.dumps(html_string), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data, [{
+            "background_color": "rgb(255, 255, 255)",
+            "count": 3,
+            "details": "The contrast ratio is 2.85. The minimum required for normal text is 4.5.",
+            "element": "<p class=\"price\" style=\"color: #999999;\">$10</p>",
+            "foreground_color": "rgb(153, 153, 153)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 2.85,
+            "rule": "COLOR_CONTRAST"
+        },
+        {
+            "background_color": "rgb(255, 255, 255)",
+            "count": 1,
+            "details": "The contrast ratio is 2.32. The minimum required for normal text is 4.5.",
+            "element": "<p style=\"color: #aaaaaa;\">Footer</p>",
+            "foreground_color": "rgb(170, 170, 170)",
+            "problem": "Low Contrast Ratio",
+            "ratio": 2.32,
+            "rule": "COLOR_CONTRAST"
+        }])
+
+    def test_sandbox(self):
+        """Test the /api/v1/html-check endpoint returns the same results when the checks run in the sandbox."""
+        html_string = { "html": "<html lang=\"en\"><head><title>T</title></head><body><p style=\"color: #eeeeee;\">Text</p></body></html>"}
+        expected = json.loads(self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json").data)
+        os.environ["ADA_SANDBOX"] = "1"
+        os.environ["ADA_SANDBOX_WORKERS"] = "1"
+        try:
+            response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+            self.assertIsNotNone(sandbox._pool)
+        finally:
+            del os.environ["ADA_SANDBOX"]
+            del os.environ["ADA_SANDBOX_WORKERS"]
+            if sandbox._pool:
+                sandbox._pool.close()
+                sandbox._pool = None
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), expected)
+        self.assertEqual(expected[0]["rule"], "COLOR_CONTRAST")
+
+    def test_sandbox_limits(self):
+        """Test the /api/v1/html-check endpoint returns 422 when a check exceeds a sandbox limit, and that the worker is replaced."""
+        html_string = { "html": "<html lang=\"en\"><head><title>T</title></head><body><a href=\"#\">Click here</a></body></html>"}
+        pool = sandbox.SandboxPool(pathological_checks, workers=1, cpu_seconds=1, memory_bytes=1024 * 1024 * 1024)
+        try:
+            with mock.patch("app.get_sandbox_pool", return_value=pool):
+                responses = {}
+                for limit in ("cpu", "memory"):
+                    pid = pool.idle_workers.queue[0]["process"].pid
+                    responses[limit] = self.app.post('/api/v1/html-check', data=json.dumps({"html": f"<{limit}>"}), content_type="application/json")
+                    self.assertNotEqual(pool.idle_workers.queue[0]["process"].pid, pid)
+
+                # The replacement worker serves the next request, and a worker that died while idle is replaced
+                ok_response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+                pool.idle_workers.queue[0]["process"].kill()
+                pool.idle_workers.queue[0]["process"].join()
+                retried_response = self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+        finally:
+            pool.close()
+        for limit, response in responses.items():
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(json.loads(response.data), {
+                "message": f"Resource limit exceeded: the html could not be checked within the {limit} limit.",
+                "error": "RESOURCE_LIMIT_EXCEEDED",
+                "limit": limit
+            })
+        for response in (ok_response, retried_response):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)[0]["rule"], "LINK_GENERIC_TEXT")
+
+    def test_monitor_changes(self):
+        """Test the /api/v1/monitors endpoints register a URL and return only the violations that changed."""
+        first_html = "<html lang=\"en\"><head><title>T</title></head><body><img src=\"a\"><a href=\"#\">Click here</a></body></html>"
+        second_html = "<html lang=\"en\"><head><title>T</title></head><body><img src=\"a\" alt=\"A\"><a href=\"#\">Click here</a><h3>Heading</h3></body></html>"
+        with tempfile.TemporaryDirectory() as db_dir:
+            os.environ.update({"ADA_MONITOR_DB": os.path.join(db_dir, "monitor.db"), "ADA_ADMIN_TOKEN": "secret"})
+            try:
+                unauthorized = self.app.post('/api/v1/monitors', data=json.dumps({"url": "https://example.com"}), content_type="application/json")
+                response = self.app.post('/api/v1/monitors', data=json.dumps({"url": "https://example.com", "interval_seconds": 600}), content_type="application/json",
+                                         headers={"Authorization": "Bearer secret"})
+                self.assertEqual(response.status_code, 201)
+                monitor_id = json.loads(response.data)["id"]
+
+                for html in (first_html, second_html):
+                    with mock.patch("monitor.requests.get", return_value=fake_page(html)):
+                        monitor.run_monitor(monitor_id, "https://example.com", run_checks)
+
+                response = self.app.get(f'/api/v1/monitors/{monitor_id}/changes')
+                monitors = json.loads(self.app.get('/api/v1/monitors').data)
+                unauthorized_delete = self.app.delete(f'/api/v1/monitors/{monitor_id}')
+                delete = self.app.delete(f'/api/v1/monitors/{monitor_id}', headers={"Authorization": "Bearer secret"})
+            finally:
+                del os.environ["ADA_MONITOR_DB"]
+                del os.environ["ADA_ADMIN_TOKEN"]
+        for response_without_token in (unauthorized, unauthorized_delete):
+            self.assertEqual(response_without_token.status_code, 401)
+            self.assertEqual(json.loads(response_without_token.data), {"message": "Unauthorized: an admin token is required"})
+        self.assertEqual(delete.status_code, 200)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(monitors[0]["last_status"], "ok")
+        changes = json.loads(response.data)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual([violation["rule"] for violation in changes[0]["new"]], ["HEADING_ORDER"])
+        self.assertEqual(changes[0]["resolved"], [{
+            "details": "Informative images must have a descriptive 'alt' attribute.",
+            "element": "<img src=\"a\">",
+            "problem": "Missing 'alt' Text",
+            "rule": "IMG_ALT_MISSING"
+        }])
+
+    def test_monitor_intervals(self):
+        """Test the /api/v1/monitors endpoint rejects intervals that aren't finite numbers and clamps the others."""
+        with tempfile.TemporaryDirectory() as db_dir:
+            os.environ.update({"ADA_MONITOR_DB": os.path.join(db_dir, "monitor.db"), "ADA_ADMIN_TOKEN": "secret"})
+            headers = {"Authorization": "Bearer secret"}
+            try:
+                invalid = [self.app.post('/api/v1/monitors', data=f'{{"url": "https://example.com", "interval_seconds": {interval}}}', content_type="application/json", headers=headers)
+                           for interval in ("Infinity", "-Infinity", "NaN", '"60"', "true")]
+                large = self.app.post('/api/v1/monitors', data=json.dumps({"url": "https://example.com", "interval_seconds": 1e30}), content_type="application/json", headers=headers)
+                small = self.app.post('/api/v1/monitors', data=json.dumps({"url": "https://example.org", "interval_seconds": 1}), content_type="application/json", headers=headers)
+
+                # Shortening the interval of a registered URL moves its next check up to within the new interval
+                reregistered = self.app.post('/api/v1/monitors', data=json.dumps({"url": "https://example.com", "interval_seconds": 60}), content_type="application/json", headers=headers)
+            finally:
+                del os.environ["ADA_MONITOR_DB"]
+                del os.environ["ADA_ADMIN_TOKEN"]
+        for response in invalid:
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data), {"message": "Invalid request: 'interval_seconds' must be a number"})
+        self.assertEqual(large.status_code, 201)
+        self.assertEqual(json.loads(large.data)["interval_seconds"], monitor.MAX_INTERVAL_SECONDS)
+        self.assertEqual(small.status_code, 201)
+        self.assertEqual(json.loads(small.data)["interval_seconds"], monitor.MIN_INTERVAL_SECONDS)
+        self.assertEqual(reregistered.status_code, 201)
+        self.assertEqual(json.loads(reregistered.data)["id"], json.loads(large.data)["id"])
+        self.assertEqual(json.loads(reregistered.data)["interval_seconds"], 60)
+        self.assertLessEqual(json.loads(reregistered.data)["next_run"], time.time() + 60)
+
+    def test_monitor_page_too_large(self):
+        """Test the monitor doesn't check pages larger than the html size limit."""
+        with tempfile.TemporaryDirectory() as db_dir:
+            db_path = os.path.join(db_dir, "monitor.db")
+            monitor_id = monitor.register_monitor("https://example.com", 600, db_path)["id"]
+            check = mock.Mock(return_value=[])
+            os.environ["ADA_MAX_HTML_BYTES"] = "1000"
+            try:
+                with mock.patch("monitor.requests.get", return_value=fake_page("<html>" + " " * 2000 + "</html>")):
+                    monitor.run_monitor(monitor_id, "https://example.com", check, db_path)
+            finally:
+                del os.environ["ADA_MAX_HTML_BYTES"]
+            monitors = monitor.list_monitors(db_path)
+        check.assert_not_called()
+        self.assertEqual(monitors[0]["last_status"], "error")
+
+    def test_monitor_scheduler(self):
+        """Test schedulers sharing a database claim each due monitor once and never run more than concurrency checks at once."""
+        urls = [f"https://example.com/{index}" for index in range(12)]
+        lock = threading.Lock()
+        checked = []
+        running = {"a": 0, "b": 0}
+        max_running = {"a": 0, "b": 0}
+
+        def make_check(scheduler):
+            def check(html):
+                with lock:
+                    checked.append(html)
+                    running[scheduler] += 1
+                    max_running[scheduler] = max(max_running[scheduler], running[scheduler])
+                time.sleep(0.05)
+                with lock:
+                    running[scheduler] -= 1
+                return []
+            return check
+
+        with tempfile.TemporaryDirectory() as db_dir:
+            db_path = os.path.join(db_dir, "monitor.db")
+            for url in urls:
+                monitor.register_monitor(url, 600, db_path)
+            # Make every monitor due
+            with monitor.connect(db_path) as conn:
+                conn.execute("UPDATE monitors SET next_run = ?", (time.time() - 1,))
+
+            stop_event = threading.Event()
+            start = time.time()
+            with mock.patch("monitor.requests.get", side_effect=lambda url, **kwargs: fake_page(f"<html>{url}</html>")):
+                schedulers = [threading.Thread(target=monitor.run_scheduler, args=(make_check(name), 2, 0.01, db_path, stop_event))
+                              for name in running]
+                for scheduler in schedulers:
+                    scheduler.start()
+                deadline = time.time() + 10
+                while len(checked) < len(urls) and time.time() < deadline:
+                    time.sleep(0.01)
+                # Give the schedulers the chance to claim a monitor twice
+                time.sleep(0.2)
+                stop_event.set()
+                for scheduler in schedulers:
+                    scheduler.join()
+            monitors = monitor.list_monitors(db_path)
+
+        self.assertEqual(sorted(checked), sorted(f"<html>{url}</html>" for url in urls))
+        for scheduler in running:
+            self.assertLessEqual(max_running[scheduler], 2)
+        self.assertEqual(max(max_running.values()), 2)
+        for registered in monitors:
+            self.assertEqual(registered["last_status"], "ok")
+            # The next run is a jittered interval after the claim
+            self.assertGreaterEqual(registered["next_run"], start + 600 * (1 - monitor.JITTER))
+            self.assertLessEqual(registered["next_run"], time.time() + 600 * (1 + monitor.JITTER))
+
+    def test_profiles(self):
+        """Test slow requests are profiled and the /api/v1/admin/profiles endpoints list and download the profiles."""
+        html_string = { "html": "<html lang=\"en\"><head><title>T</title></head><body><p style=\"color: #eeeeee;\">Text</p></body></html>"}
+
+        def slow_checks(*args):
+            time.sleep(0.3)
+            return run_checks(*args)
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            os.environ.update({"ADA_PROFILE_DIR": profile_dir, "ADA_PROFILE_THRESHOLD_MS": "200", "ADA_PROFILE_INTERVAL_MS": "5", "ADA_ADMIN_TOKEN": "secret"})
+            try:
+                # Only the slow request is profiled
+                self.app.get('/')
+                with mock.patch("app.run_checks", side_effect=slow_checks):
+                    self.app.post('/api/v1/html-check', data=json.dumps(html_string), content_type="application/json")
+                unauthorized = self.app.get('/api/v1/admin/profiles')
+                profiles = json.loads(self.app.get('/api/v1/admin/profiles', headers={"Authorization": "Bearer secret"}).data)
+                download = self.app.get(f'/api/v1/admin/profiles/{profiles[0]["name"]}', headers={"Authorization": "Bearer secret"})
+                collapsed = download.data.decode("utf-8")
+                download.close()
+            finally:
+                for name in ("ADA_PROFILE_DIR", "ADA_PROFILE_THRESHOLD_MS", "ADA_PROFILE_INTERVAL_MS", "ADA_ADMIN_TOKEN"):
+                    del os.environ[name]
+        self.assertEqual(unauthorized.status_code, 404)
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]["path"], "/api/v1/html-check")
+        self.assertGreaterEqual(profiles[0]["duration_ms"], 300)
+        self.assertEqual(profiles[0]["input"]["bytes"], len(html_string["html"]))
+        self.assertGreater(profiles[0]["samples"], 0)
+        self.assertEqual(download.status_code, 200)
+        self.assertIn("app:check_string;app:check_html_accessibility", collapsed)
+
+class TestProfiler(unittest.TestCase):
+    """
+    A class for unit testing the helpers of the profiler.
+    """
+
+    def test_input_stats(self):
+        """Test the size statistics of a profiled html string, including html with unclosed <style> tags."""
+        stats = profiler.get_input_stats("<html><STYLE type=\"text/css\">p {}</style><style>a {}</STYLE></html>")
+        self.assertEqual(stats["style_characters"], 8)
+        self.assertEqual(stats["tags"], 6)
+
+        start = time.perf_counter()
+        stats = profiler.get_input_stats("<style>" * 100000)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(stats["style_characters"], 0)
+
+class TestLoadTest(unittest.TestCase):
+    """
+    A class for unit testing the helpers of the load-testing harness.
+    """
+
+    def test_percentile(self):
+        """Test the nearest-rank percentiles of a sorted list."""
+        values = list(range(1, 101))
+        self.assertEqual(load_test.percentile(values, 50), 50)
+        self.assertEqual(load_test.percentile(values, 95), 95)
+        self.assertEqual(load_test.percentile(values, 99), 99)
+        self.assertEqual(load_test.percentile([7], 99), 7)
+        self.assertIsNone(load_test.percentile([], 50))
+
+    def test_make_page(self):
+        """Test the synthetic pages are at least the requested size and are checked like real pages."""
+        for size in (100, 5000):
+            page = load_test.make_page(size)
+            self.assertGreaterEqual(len(page), size)
+            self.assertLess(len(page), size + len(load_test.PAGE_BLOCK) + 20)
+        rules = {violation["rule"] for violation in run_checks(load_test.make_page(5000))}
+        self.assertIn("COLOR_CONTRAST", rules)
+        self.assertIn("LINK_GENERIC_TEXT", rules)
+
 # --- Main block to run the tests ---
 if __name__ == '__main__':
     unittest.main()